@@ -11,11 +11,38 @@
 #############################################################
 # 导入模块
 import argparse
+import concurrent.futures
+import contextlib
+import difflib
+import hashlib
+import heapq
+import io
+import itertools
+import json
+import mmap
 import os
+import queue
+import re
+import shutil
+import signal
+import socket
+import socketserver
+import stat
 import sys
 import struct
+import tarfile
+import tempfile
+import threading
+import time
+import traceback
+import zipfile
 import zlib
 import lzma
+# 可选模块，只在输出tar.zst归档时需要
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
 #############################################################
 # 全局变量
 ## 设置提取到的文件的命名
@@ -28,6 +55,45 @@ kernel_gzip_file = "/kernel.gz"
 kernel_lzma_file = "/kernel.xz"
 bootparam_file = "/bootparams.txt"
 filesystem_dir = "/filesystem"
+installer_dir = "/installer"
+## 目录索引文件与固件文件放在同一目录下，文件名为固件文件名加上后缀
+index_file_suffix = ".idx"
+manifest_file = "/manifest.jsonl"
+## 查找内核压缩数据结尾时，每次送入解压器的数据块大小
+STREAM_CHUNK_SIZE = 0x10000
+## 解压流水线：每个解压线程对应的写入队列长度，以及交给解压线程池的压缩条目的最小大小
+PIPELINE_DEPTH = 4
+PIPELINE_MIN_SIZE = 0x4000
+## 写入目录树时打开、写入和关闭文件的I/O线程数上限
+OUTPUT_IO_THREADS = 4
+## 不小于该大小的条目在解压线程池中计算CRC32，与解压和写入并行
+VERIFY_PARALLEL_SIZE = 0x100000
+## 大于该大小的条目数据分块写入磁盘
+COPY_CHUNK_SIZE = 0x100000
+## 搜索时能跨越内容块边界找到的正则匹配的最大长度，以及交给一个搜索进程的条目的最小总大小
+SEARCH_OVERLAP = 0x1000
+SEARCH_UNIT_SIZE = 0x400000
+## Linux上reflink所用的ioctl请求号
+FICLONE = 0x40049409
+## 提取清单的版本，以及判断是否提取完成时从清单末尾读取的长度
+MANIFEST_VERSION = 1
+MANIFEST_TAIL_SIZE = 0x1000
+## 归档输出格式，以及归档文件名的后缀
+ARCHIVE_TAR = "tar"
+ARCHIVE_TAR_ZST = "tar.zst"
+ARCHIVE_ZIP = "zip"
+ARCHIVE_FORMATS = (ARCHIVE_TAR, ARCHIVE_TAR_ZST, ARCHIVE_ZIP)
+## 设备文件的原始数据以扩展属性的形式保存在tar的pax头中
+ARCHIVE_DEVICE_DATA = "SCHILY.xattr.user.parrot.device_data"
+## 超过该大小的zip成员使用zip64
+ZIP64_SIZE = 0x7FFFFFFF
+## 内核、bootloader等输出文件的权限
+OUTPUT_FILE_PERMISSIONS = 0o644
+## 进程的umask，只能通过设置umask读取，而umask是整个进程共用的，所以在导入时、其他线程启动之前读取一次
+OUTPUT_UMASK = os.umask(0)
+os.umask(OUTPUT_UMASK)
+## 归档中输出目录、filesystem目录等没有对应目录条目的目录的权限
+OUTPUT_DIR_PERMISSIONS = 0o755
 ## 固件头字段常量
 P_HDR_MAGIC = "header_magic_number"
 P_HDR_VER = "header_version"
@@ -43,18 +109,25 @@ P_HDR_MINOR_VERSION = "minor_version"
 P_HDR_BUGFIX_VERSION = "bugfix_version"
 P_HDR_LANG_ZONE = "language_zone"
 P_HDR_FILE_SIZE = "file_size"
-## 条目头字段常量
-P_ENTRY_TYPE = "entry_type"
-P_ENTRY_SIZE = "entry_size"
-P_ENTRY_CRC32 = "crc32"
-P_ENTRY_LOADADDR = "load_address"
-P_ENTRY_UNCOMPRESSED_SIZE = "uncompressed_size"
+## 固件头字段按照在文件中的顺序排列
+PLF_HEADER_FIELDS = (P_HDR_MAGIC, P_HDR_VER, P_HDR_SIZE, P_HDR_ENTRY_HDR_SIZE, P_HDR_FILE_TYPE, P_HDR_ENTRYPOINT,
+                     P_HDR_TARGET_PLAT, P_HDR_TARGET_APPL, P_HDR_HW_COMPAT, P_HDR_MAJOR_VERSION, P_HDR_MINOR_VERSION,
+                     P_HDR_BUGFIX_VERSION, P_HDR_LANG_ZONE, P_HDR_FILE_SIZE)
+PLF_MAGIC = b"PLF!"
 ## 条目类型
 ENTRY_VOLUME_CONFIG = 0x0B
 ENTRY_INSTALLER = 0x0C
 ENTRY_BOOTLOADER = 0x07
 ENTRY_MAINBOOT = 0x03
 ENTRY_FILESYSTEM = 0x09
+## main_boot.plf中的条目类型
+KERNEL_ZIMAGE = 0x00
+KERNEL_BOOTPARAM = 0x07
+## 递归解析嵌套PLF的最大层数
+PLF_MAX_DEPTH = 4
+## 各类条目提取后对应的输出文件
+entry_output_files = {ENTRY_VOLUME_CONFIG: volume_config_file, ENTRY_INSTALLER: installer_file,
+                      ENTRY_BOOTLOADER: bootloader_file, ENTRY_MAINBOOT: kernel_plf_file}
 ## 分区数以及挂载的分区数据
 NB_ENTRIES = "number_partitions"
 P_VOLUME_DEVICE_NUM = "device_number"
@@ -65,22 +138,83 @@ P_VOLUME_SIZE = "volume_size"
 P_VOLUME_ACTION = "volume_action"
 P_VOLUME_NAME = "volume_name"
 P_VOLUME_MOUNT_NAME = "mount_name"
+VOLUME_PARTITION_FIELDS = (P_VOLUME_DEVICE_NUM, P_VOLUME_TYPE, P_VOLUME_NUM, P_VOLUME_UNKNOWN, P_VOLUME_SIZE,
+                           P_VOLUME_ACTION, P_VOLUME_NAME, P_VOLUME_MOUNT_NAME)
 ## 文件系统属性
 FS_DIR = 0x04
 FS_FILE = 0x08
 FS_SYMLINK = 0x0A
-P_TYPE = "type"
-P_FILENAME = "file_name"
-P_FILEPER = "file_permissions"
-P_FILEDATA = "file_data"
-P_DIRNAME = "directory_name"
-P_DIRPER = "directory_permissions"
-P_SYMLINK = "symbol_link"
-## 文件信息统计
-FILE_NUM = 0
-DIR_NUM = 0
-SYMLINK_NUM = 0
-UNKNOWN_NUM = 0
+FS_DEVICE = 0x02
+FS_TYPE_CHARS = {FS_DIR: 'd', FS_FILE: '-', FS_SYMLINK: 'l', FS_DEVICE: 'c'}
+## iter_entries()给出的条目种类
+KIND_VOLUME_CONFIG = "volume_config"
+KIND_INSTALLER = "installer"
+KIND_BOOTLOADER = "bootloader"
+KIND_MAINBOOT = "main_boot"
+KIND_DIRECTORY = "directory"
+KIND_FILE = "file"
+KIND_SYMLINK = "symlink"
+KIND_DEVICE = "device"
+KIND_ZIMAGE = "zimage"
+KIND_BOOTPARAM = "bootparams"
+KIND_UNKNOWN = "unknown"
+entry_kinds = {ENTRY_VOLUME_CONFIG: KIND_VOLUME_CONFIG, ENTRY_INSTALLER: KIND_INSTALLER, ENTRY_BOOTLOADER: KIND_BOOTLOADER,
+               ENTRY_MAINBOOT: KIND_MAINBOOT}
+filesystem_kinds = {FS_DIR: KIND_DIRECTORY, FS_FILE: KIND_FILE, FS_SYMLINK: KIND_SYMLINK, FS_DEVICE: KIND_DEVICE}
+## 预编译的结构体布局（小端序），每个头部只需一次解码
+PLF_HEADER = struct.Struct("<4s13I")
+PLF_ENTRY_HEADER = struct.Struct("<5I")
+VOLUME_CONFIG_HEADER = struct.Struct("<10I")
+VOLUME_PARTITION = struct.Struct("<4H2I32s32s")
+FS_ENTRY_HEADER = struct.Struct("<3I")
+INDEX_HEADER = struct.Struct("<4sIQQI")
+INDEX_RECORD = struct.Struct("<IBxHIIIIHH")
+INDEX_MAGIC = b"PLFI"
+INDEX_VERSION = 1
+## 建立索引时，压缩条目只解压开头的这么多字节来读取文件名和权限
+INDEX_PEEK_SIZE = 0x200
+## 文件信息统计，每个固件单独计数
+FILE_NUM = "file_num"
+DIR_NUM = "directory_num"
+SYMLINK_NUM = "symbol_link_num"
+UNKNOWN_NUM = "unknown_num"
+VERIFY_NUM = "verified_num"
+CRC_ERROR_NUM = "crc_error_num"
+VERIFY_TIME = "verify_time"
+STORE_HIT_NUM = "store_hit_num"
+STORE_NEW_NUM = "store_new_num"
+STORE_DEDUP_NUM = "store_dedup_num"
+EXTRACTED_NUM = "extracted_num"
+SKIPPED_NUM = "skipped_num"
+UP_TO_DATE = "up_to_date"
+METRICS = "metrics"
+## parse_firmware各阶段的耗时
+TIME_HEADER = "header"
+TIME_VOLUME_CONFIG = "volume_config"
+TIME_BOOTLOADER = "bootloader"
+TIME_KERNEL = "kernel"
+TIME_INSTALLER = "installer"
+TIME_FILESYSTEM = "filesystem"
+TIME_VERIFY = "verify"
+TIME_SYMLINK = "symlink"
+TIME_MANIFEST = "manifest"
+TIMING_PHASES = (TIME_HEADER, TIME_VOLUME_CONFIG, TIME_BOOTLOADER, TIME_KERNEL, TIME_INSTALLER, TIME_FILESYSTEM,
+                 TIME_VERIFY, TIME_SYMLINK, TIME_MANIFEST)
+## 度量中统计次数的文件系统操作，以及保留的最慢条目数
+OP_STAT = "stat"
+OP_MKDIR = "mkdir"
+OP_CHMOD = "chmod"
+OP_OPEN = "open"
+OP_UNLINK = "unlink"
+OP_LINK = "link"
+OP_SYMLINK = "symlink"
+METRIC_OPERATIONS = (OP_STAT, OP_MKDIR, OP_CHMOD, OP_OPEN, OP_UNLINK, OP_LINK, OP_SYMLINK)
+METRICS_SLOWEST_NUM = 10
+## 度量输出格式
+METRICS_JSON = "json"
+METRICS_PROMETHEUS = "prometheus"
+entry_timing_phases = {ENTRY_VOLUME_CONFIG: TIME_VOLUME_CONFIG, ENTRY_INSTALLER: TIME_INSTALLER, ENTRY_BOOTLOADER: TIME_BOOTLOADER,
+                       ENTRY_MAINBOOT: TIME_KERNEL, ENTRY_FILESYSTEM: TIME_FILESYSTEM}
 #############################################################
 
 class Logger(object):
@@ -88,334 +222,1783 @@ class Logger(object):
         self.output = sys.stdout
         self.log = False
         self.info = False
-    def print_log(self, _message):
+    # 消息的参数在输出时才格式化，关闭日志时不产生格式化的开销
+    def print_log(self, _message, *_args):
         if self.log:
-            self.output.write("[>] " + _message + "\n")
-    def print_info(self, _message):
+            self.output.write("[>] " + (_message.format(*_args) if _args else _message) + "\n")
+    def print_info(self, _message, *_args):
         if self.info:
-            self.output.write("[*] " + _message + "\n")
-class FirmwareFile(object):
-    def __init__(self, _file, _dir, _logger):
-        self.firmware = _file
-        self.outputdir = _dir
+            self.output.write("[*] " + (_message.format(*_args) if _args else _message) + "\n")
+    def print_error(self, _message):
+        # 错误信息总是输出
+        sys.stderr.write("[!] " + _message + "\n")
+class ExtractOptions(object):
+    def __init__(self):
+        # 解压和写入文件系统条目所用的线程数，1表示全部在读取线程中完成
+        self.threads = 1
+        # 提取时校验每个条目的CRC32；只校验时不写入任何文件
+        self.verify = True
+        self.verify_only = False
+        # 按内容去重的文件存储目录，为None时直接写入文件
+        self.store = None
+        # 根据上次提取留下的清单跳过已经提取的固件和条目
+        self.resume = True
+        # 归档格式，为None时写入目录树；stdout为True时归档写入标准输出
+        self.format = None
+        self.stdout = False
+        # 收集提取过程的度量，结果保存在统计信息的METRICS中
+        self.metrics = False
+class ExtractionPipeline(object):
+    # 读取线程解析条目，较大的压缩条目交给解压线程池，写入线程按提交顺序创建目录和文件。
+    # 写入队列有长度上限，队列满时读取线程阻塞，从而限制同时驻留在内存中的解压数据。
+    def __init__(self, _threads):
+        self.executor = None
+        self.jobs = None
+        self.writer = None
+        self.error = None
+        if _threads > 1:
+            self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=_threads)
+            self.jobs = queue.Queue(maxsize=_threads * PIPELINE_DEPTH)
+            self.writer = threading.Thread(target=self._write_loop, name="plf-writer", daemon=True)
+            self.writer.start()
+    def submit(self, _function, *_args):
+        if self.executor is None:
+            return _function(*_args)
+        if self.error is not None:
+            return None
+        return self.executor.submit(_function, *_args)
+    def write(self, _function, *_args):
+        if self.writer is None:
+            _function(*_args)
+        elif self.error is None:
+            self.jobs.put((_function, _args))
+    def _write_loop(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                break
+            if self.error is not None:
+                # 出错之后只清空队列，不再写入
+                continue
+            function, args = job
+            try:
+                args = [arg.result() if isinstance(arg, concurrent.futures.Future) else arg for arg in args]
+                function(*args)
+            except BaseException as e:
+                self.error = e
+    def close(self):
+        # 等待所有写入完成，解压或写入过程中的异常在这里抛出
+        if self.writer is not None:
+            self.jobs.put(None)
+            self.writer.join()
+            self.executor.shutdown()
+            self.writer = None
+        if self.error is not None:
+            raise self.error
+class OutputWriter(object):
+    # 目录树的输出层。记录已经存在的目录，每个文件不必再检查和创建其所在目录；
+    # 文件的打开、写入和关闭交给少量I/O线程，队列有长度上限；文件创建时即带有最终权限，通常不需要再chmod。
+    # 目录只在写入线程中按条目顺序创建。close()等待所有文件写入完成，写入过程中的异常在这里抛出。
+    def __init__(self, _threads, _metrics=None):
+        self.metrics = _metrics
+        self.directories = set()
+        self.lock = threading.Lock()
+        # 尚未写入完成的条目，以及写入完成后要执行的回调（如记录清单）
+        self.pending = {}
+        self.error = None
+        self.workers = []
+        self.jobs = None
+        # umask会去掉的权限位以及特殊权限位需要在创建后再设置
+        self.umask = OUTPUT_UMASK
+        if _threads > 1:
+            io_threads = min(_threads, OUTPUT_IO_THREADS)
+            self.jobs = queue.Queue(maxsize=io_threads * PIPELINE_DEPTH)
+            for i in range(0, io_threads):
+                worker = threading.Thread(target=self._io_loop, name="plf-io-{}".format(i), daemon=True)
+                worker.start()
+                self.workers.append(worker)
+    def _count(self, _operation, _number=1):
+        if self.metrics is not None:
+            self.metrics.count(_operation, _number)
+    def _add_directory(self, _dir_name):
+        while _dir_name and _dir_name not in self.directories:
+            self.directories.add(_dir_name)
+            _dir_name = os.path.dirname(_dir_name)
+    def make_dirs(self, _dir_name):
+        # 目录不存在时创建，返回是否新建了目录
+        if _dir_name in self.directories:
+            return False
+        self._count(OP_STAT)
+        created = False
+        if not os.path.isdir(_dir_name):
+            self._count(OP_MKDIR)
+            os.makedirs(_dir_name, exist_ok=True)
+            created = True
+        self._add_directory(_dir_name)
+        return created
+    def make_directory(self, _dir_name, _permissions):
+        # 文件系统条目中的目录：不存在时以其权限创建，已存在时修改权限，返回是否新建了目录
+        if _dir_name not in self.directories:
+            self._count(OP_STAT)
+            if not os.path.exists(_dir_name):
+                self._count(OP_MKDIR)
+                os.makedirs(_dir_name, mode=_permissions)
+                self._add_directory(_dir_name)
+                return True
+            self._add_directory(_dir_name)
+        self._count(OP_CHMOD)
+        os.chmod(_dir_name, _permissions)
+        return False
+    def open_file(self, _file_name, _permissions):
+        # 已存在的文件可能是指向存储的硬链接，先删除再创建，不修改其他链接共享的内容
+        flags = os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, "O_BINARY", 0) | getattr(os, "O_CLOEXEC", 0)
+        self._count(OP_OPEN)
+        try:
+            fd = os.open(_file_name, flags, _permissions)
+        except FileExistsError:
+            self._count(OP_UNLINK)
+            os.unlink(_file_name)
+            fd = os.open(_file_name, flags, _permissions)
+        if _permissions & (self.umask | 0o7000):
+            self._count(OP_CHMOD)
+            os.chmod(fd, _permissions)
+        return os.fdopen(fd, 'wb')
+    def submit(self, _key, _function, *_args):
+        # _key为条目时，在其写入完成之前通过after()登记的回调会推迟到写入完成之后执行
+        if not self.workers:
+            _function(*_args)
+            return
+        if self.error is not None:
+            return
+        if _key is not None:
+            with self.lock:
+                self.pending[_key] = []
+        self.jobs.put((_key, _function, _args))
+    def after(self, _key, _function, *_args):
+        with self.lock:
+            callbacks = self.pending.get(_key)
+            if callbacks is not None:
+                callbacks.append((_function, _args))
+            else:
+                _function(*_args)
+    def after_all(self, _function, *_args):
+        # 在此之前提交的所有文件都写入完成之后执行回调，用于本身同步写入、但包含I/O线程写入的嵌套条目的条目（如installer.plf）
+        with self.lock:
+            keys = list(self.pending)
+            if not keys:
+                _function(*_args)
+                return
+            remaining = [len(keys)]
+            def done():
+                remaining[0] = remaining[0] - 1
+                if remaining[0] == 0:
+                    _function(*_args)
+            for key in keys:
+                self.pending[key].append((done, ()))
+    def _io_loop(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                break
+            key, function, args = job
+            try:
+                if self.error is None:
+                    function(*args)
+                with self.lock:
+                    callbacks = self.pending.pop(key, ()) if key is not None else ()
+                    # 写入失败之后不再执行回调，清单中不会记录没有写完的条目
+                    if self.error is None:
+                        for callback, callback_args in callbacks:
+                            callback(*callback_args)
+            except BaseException as e:
+                self.error = e
+    def close(self):
+        if self.workers:
+            for worker in self.workers:
+                self.jobs.put(None)
+            for worker in self.workers:
+                worker.join()
+            self.workers = []
+        if self.error is not None:
+            raise self.error
+class ContentStore(object):
+    # 按内容保存文件的存储目录，所有固件共用：
+    # objects/下每个不同的文件内容（连同权限）只保存一次，文件名为内容的sha256和权限；
+    # keys/下以条目原始数据（压缩条目为压缩后的数据，包括文件名和权限）的sha256为名，链接到对应的objects/文件，
+    # 提取时命中keys/的条目无需解压和写入，直接链接到固件的文件系统目录中。
+    # 条目的CRC32不能用作键，原因见FirmwareFile._finish_verification()。
+    def __init__(self, _root):
+        self.root = _root
+        self.objects_dir = os.path.join(_root, "objects")
+        self.keys_dir = os.path.join(_root, "keys")
+        self.temp_dir = os.path.join(_root, "tmp")
+        for dir_name in (self.objects_dir, self.keys_dir, self.temp_dir):
+            os.makedirs(dir_name, exist_ok=True)
+    def entry_key(self, _data):
+        return hashlib.sha256(_data).hexdigest()
+    def _key_path(self, _fentry):
+        return os.path.join(self.keys_dir, _fentry.store_key[0:2], _fentry.store_key)
+    def contains(self, _fentry):
+        return os.path.exists(self._key_path(_fentry))
+    def link_entry(self, _fentry, _file_full_name):
+        self.link(self._key_path(_fentry), _file_full_name)
+    def temp_file(self):
+        return tempfile.mkstemp(dir=self.temp_dir)
+    def add(self, _temp_file_name, _digest, _permissions, _fentry):
+        # 通过建立硬链接保存，多个进程同时保存同一内容时只有一个成功，其余的直接使用已有文件
+        blob = os.path.join(self.objects_dir, _digest[0:2], "{}.{:04o}".format(_digest, _permissions))
+        os.makedirs(os.path.dirname(blob), exist_ok=True)
+        is_new = True
+        try:
+            os.link(_temp_file_name, blob)
+        except FileExistsError:
+            is_new = False
+        os.unlink(_temp_file_name)
+        key_path = self._key_path(_fentry)
+        os.makedirs(os.path.dirname(key_path), exist_ok=True)
+        try:
+            os.link(blob, key_path)
+        except FileExistsError:
+            pass
+        return blob, is_new
+    def link(self, _blob, _file_full_name):
+        if os.path.lexists(_file_full_name):
+            os.unlink(_file_full_name)
+        try:
+            os.link(_blob, _file_full_name)
+        except OSError:
+            # 跨文件系统或者硬链接数达到上限时，先尝试reflink，再退回到复制
+            self._clone(_blob, _file_full_name)
+    def _clone(self, _blob, _file_full_name):
+        with open(_blob, 'rb') as src, open(_file_full_name, 'wb') as dst:
+            try:
+                import fcntl
+                fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+            except (ImportError, OSError):
+                shutil.copyfileobj(src, dst, COPY_CHUNK_SIZE)
+        shutil.copymode(_blob, _file_full_name)
+class ExtractionMetrics(object):
+    # 提取过程的度量：各阶段和各条目类型的耗时与字节数、解压比、文件系统操作次数以及最慢的条目。
+    # 读取线程、解压线程和写入线程都会更新，计数在锁内累加。
+    def __init__(self, _slowest=METRICS_SLOWEST_NUM):
+        self.lock = threading.Lock()
+        self.entry_types = {}
+        self.phase_bytes = dict.fromkeys(TIMING_PHASES, 0)
+        self.phase_entries = dict.fromkeys(TIMING_PHASES, 0)
+        self.operations = dict.fromkeys(METRIC_OPERATIONS, 0)
+        self.compressed_bytes = 0
+        self.uncompressed_bytes = 0
+        self.decompress_num = 0
+        self.decompress_time = 0.0
+        self.slowest_num = _slowest
+        self.slowest = []
+    def count(self, _operation, _number=1):
+        with self.lock:
+            self.operations[_operation] = self.operations[_operation] + _number
+    def record_entry(self, _fentry, _phase, _elapsed):
+        # 只在读取线程中调用；最慢的条目用最小堆保留前N个
+        record = self.entry_types.setdefault(_fentry.entry_type, [0, 0, 0.0])
+        record[0] = record[0] + 1
+        record[1] = record[1] + _fentry.size
+        record[2] = record[2] + _elapsed
+        if _phase is not None:
+            self.phase_entries[_phase] = self.phase_entries[_phase] + 1
+            self.phase_bytes[_phase] = self.phase_bytes[_phase] + _fentry.size
+        if len(self.slowest) < self.slowest_num:
+            heapq.heappush(self.slowest, (_elapsed, _fentry.offset, _fentry))
+        elif _elapsed > self.slowest[0][0]:
+            heapq.heapreplace(self.slowest, (_elapsed, _fentry.offset, _fentry))
+    def record_phase_bytes(self, _phase, _bytes):
+        self.phase_bytes[_phase] = self.phase_bytes[_phase] + _bytes
+    def record_decompression(self, _compressed_size, _uncompressed_size, _elapsed):
+        with self.lock:
+            self.decompress_num = self.decompress_num + 1
+            self.compressed_bytes = self.compressed_bytes + _compressed_size
+            self.uncompressed_bytes = self.uncompressed_bytes + _uncompressed_size
+            self.decompress_time = self.decompress_time + _elapsed
+    def report(self, _firmware, _elapsed):
+        phases = {}
+        for phase in TIMING_PHASES:
+            phases[phase] = {"seconds": _firmware.timings[phase], "bytes": self.phase_bytes[phase], "entries": self.phase_entries[phase]}
+        entry_types = {}
+        for entry_type, (number, size, elapsed) in sorted(self.entry_types.items()):
+            entry_types["0x{:02x}".format(entry_type)] = {"entries": number, "bytes": size, "seconds": elapsed}
+        slowest = []
+        for elapsed, offset, fentry in sorted(self.slowest, reverse=True):
+            slowest.append({"offset": offset, "type": "0x{:02x}".format(fentry.entry_type), "path": fentry.path, "size": fentry.size,
+                            "seconds": elapsed})
+        return {"firmware": _firmware.firmware, "size": os.path.getsize(_firmware.firmware),
+                "seconds": _elapsed, "phases": phases, "entry_types": entry_types,
+                "decompression": {"entries": self.decompress_num, "compressed_bytes": self.compressed_bytes,
+                                  "uncompressed_bytes": self.uncompressed_bytes, "seconds": self.decompress_time,
+                                  "ratio": self.uncompressed_bytes / self.compressed_bytes if self.compressed_bytes else 0.0},
+                "operations": dict(self.operations), "slowest_entries": slowest,
+                "statistics": {key: value for key, value in _firmware.statistics.items() if key != METRICS}}
+class PatternMatcher(object):
+    # 多模式匹配：所有模式合并为一个正则表达式，每个缓冲区只扫描一遍。
+    # 字面模式合并成前缀树形式的表达式，由匹配到的文本确定是哪个模式；正则模式各占一个命名分组。
+    def __init__(self, _patterns, _is_regex=False, _ignore_case=False):
+        self.patterns = [pattern.encode("utf-8") if isinstance(pattern, str) else pattern for pattern in _patterns]
+        self.is_regex = _is_regex
+        self.ignore_case = _ignore_case
+        flags = re.DOTALL | (re.IGNORECASE if _ignore_case else 0)
+        # 正则模式通常合并为一个表达式；含有分组（包括反向引用的分组）或者合并后无法编译（如不在开头的内联标志）时，
+        # 每个模式单独编译，分别扫描后按偏移合并结果
+        self.combined = True
+        if _is_regex:
+            regexes = [re.compile(pattern, flags) for pattern in self.patterns]
+            self.regexes = regexes
+            if len(regexes) > 1 and all(regex.groups == 0 for regex in regexes):
+                try:
+                    self.regexes = [re.compile(b"|".join(b"(?P<p%d>%s)" % (i, pattern) for i, pattern in enumerate(self.patterns)), flags)]
+                except re.error:
+                    pass
+            self.combined = len(self.regexes) == 1 and len(regexes) > 1
+            # 正则匹配的长度未知，跨越块边界时只保证不超过SEARCH_OVERLAP的匹配
+            self.overlap = SEARCH_OVERLAP
+        else:
+            self.literals = {}
+            for pattern in self.patterns:
+                self.literals.setdefault(pattern.lower() if _ignore_case else pattern, pattern)
+            self.regexes = [re.compile(self._trie_regex(self.literals), flags)]
+            self.overlap = max(len(pattern) for pattern in self.patterns) - 1
+    def _trie_regex(self, _literals):
+        trie = {}
+        for literal in _literals:
+            node = trie
+            for byte in literal:
+                node = node.setdefault(byte, {})
+            node[None] = None
+        return self._node_regex(trie)
+    def _node_regex(self, _node):
+        # 子节点按字节排序合并为一组选择，模式在此结束时其后的部分可选，同一位置优先匹配较长的模式
+        alternatives = [re.escape(bytes([byte])) + self._node_regex(child) for byte, child in sorted(
+            (byte, child) for byte, child in _node.items() if byte is not None)]
+        if not alternatives:
+            return b""
+        if len(alternatives) == 1 and None not in _node:
+            return alternatives[0]
+        regex = b"(?:" + b"|".join(alternatives) + b")"
+        if None in _node:
+            regex = regex + b"?"
+        return regex
+    def _pattern(self, _index, _match):
+        if not self.is_regex:
+            text = _match.group()
+            return self.literals[text.lower() if self.ignore_case else text]
+        if self.combined:
+            return self.patterns[int(_match.lastgroup[1:])]
+        return self.patterns[_index]
+    def search(self, _chunks):
+        # 依次扫描内容块，返回(偏移, 模式, 匹配文本)。每块与上一块末尾的overlap字节一起扫描，
+        # 开始于末尾overlap字节内的匹配留到下一块再报告。每个表达式的扫描从其上一个匹配的结尾继续，
+        # 跨越块边界的匹配既不会遗漏也不会重复，结果与整体扫描一次相同
+        tail = b""
+        base = 0
+        reported = [0] * len(self.regexes)
+        for chunk in _chunks:
+            buffer = tail + chunk
+            yield from self._scan(buffer, base, base + len(buffer) - self.overlap, reported)
+            keep = min(len(buffer), self.overlap)
+            tail = buffer[len(buffer) - keep:]
+            base = base + len(buffer) - keep
+        yield from self._scan(tail, base, base + len(tail), reported)
+    def _scan(self, _buffer, _base, _limit, _reported):
+        hits = []
+        for index, regex in enumerate(self.regexes):
+            for match in regex.finditer(_buffer, max(0, _reported[index] - _base)):
+                start = _base + match.start()
+                if start >= _limit:
+                    break
+                hits.append((start, index, match))
+                _reported[index] = _base + max(match.end(), match.start() + 1)
+            _reported[index] = max(_reported[index], _limit)
+        if len(self.regexes) > 1:
+            hits.sort(key=lambda hit: hit[0:2])
+        for start, index, match in hits:
+            yield start, self._pattern(index, match), match.group()
+class ArchiveWriter(object):
+    # 把提取结果按顺序写入一个tar、tar.zst或者zip归档（"-"表示标准输出），不在磁盘上创建目录树。
+    # 权限、目录、符号链接和设备文件都作为归档成员的元数据保存，所有成员位于以固件命名的目录下。
+    # 与输出目录一样，每个成员所在的各级目录（包括以固件命名的目录）都作为目录成员写入归档。
+    def __init__(self, _file_name, _format, _prefix, _mtime):
+        self.format = _format
+        self.prefix = _prefix
+        self.mtime = _mtime
+        self.directories = {}
+        # 已经写入的目录，""表示以固件命名的目录
+        self.added = set()
+        if _file_name == "-":
+            self.output = sys.stdout.buffer
+            self.close_output = False
+        else:
+            self.output = open(_file_name, 'wb')
+            self.close_output = True
+        self.compressor = None
+        self.tar = None
+        self.zip = None
+        if _format == ARCHIVE_ZIP:
+            self.zip = zipfile.ZipFile(self.output, 'w', zipfile.ZIP_DEFLATED)
+        else:
+            fileobj = self.output
+            if _format == ARCHIVE_TAR_ZST:
+                self.compressor = zstandard.ZstdCompressor().stream_writer(self.output, closefd=False)
+                fileobj = self.compressor
+            self.tar = tarfile.open(fileobj=fileobj, mode='w|', format=tarfile.PAX_FORMAT)
+    def _tar_info(self, _name, _type, _permissions):
+        info = tarfile.TarInfo(self.prefix + '/' + _name)
+        info.type = _type
+        info.mode = _permissions
+        info.mtime = self.mtime
+        return info
+    def _zip_info(self, _name, _mode):
+        info = zipfile.ZipInfo(self.prefix + '/' + _name, time.localtime(self.mtime)[0:6])
+        # 高16位保存Unix文件类型和权限
+        info.create_system = 3
+        info.external_attr = _mode << 16
+        info.compress_type = zipfile.ZIP_DEFLATED
+        return info
+    def _add_parents(self, _name):
+        # 成员所在的目录还没有写入时，以默认权限从外到内逐级写入，每个目录只写入一次
+        parents = []
+        while _name:
+            _name = _name.rpartition('/')[0]
+            if _name in self.added:
+                break
+            parents.append(_name)
+        for name in reversed(parents):
+            self._write_directory(name, OUTPUT_DIR_PERMISSIONS)
+    def _write_directory(self, _name, _permissions):
+        self.added.add(_name)
+        if self.zip is not None:
+            # zip中的同名成员无法覆盖，目录在关闭归档时写入，同一目录以最后一次的权限为准
+            self.directories[_name] = _permissions
+        else:
+            # tar解包时同名成员以后写入的为准，目录条目在其目录已经写入之后出现时再写入一次以保存其权限
+            self.tar.addfile(self._tar_info(_name, tarfile.DIRTYPE, _permissions))
+    def add_directory(self, _name, _permissions):
+        self._add_parents(_name)
+        self._write_directory(_name, _permissions)
+    def add_file(self, _name, _permissions, _data, _release=None):
+        # 较大的数据分块写入，每写完一块调用_release(块的起始位置, 长度)
+        self._add_parents(_name)
+        if self.zip is not None:
+            info = self._zip_info(_name, stat.S_IFREG | _permissions)
+            info.file_size = len(_data)
+            with self.zip.open(info, 'w', force_zip64=len(_data) >= ZIP64_SIZE) as f:
+                for index in range(0, len(_data), COPY_CHUNK_SIZE):
+                    chunk = _data[index:index + COPY_CHUNK_SIZE]
+                    f.write(chunk)
+                    if _release is not None:
+                        _release(index, len(chunk))
+                f.close()
+        else:
+            info = self._tar_info(_name, tarfile.REGTYPE, _permissions)
+            info.size = len(_data)
+            self.tar.addfile(info, ArchiveDataReader(_data, _release))
+    def add_symlink(self, _name, _target):
+        self._add_parents(_name)
+        if self.zip is not None:
+            self.zip.writestr(self._zip_info(_name, stat.S_IFLNK | 0o777), _target.encode("utf-8"))
+        else:
+            info = self._tar_info(_name, tarfile.SYMTYPE, 0o777)
+            info.linkname = _target
+            self.tar.addfile(info)
+    def add_device(self, _name, _permissions, _data):
+        # 设备号的编码方式未知，条目中的原始数据保存在tar的pax头或者zip成员的注释中
+        self._add_parents(_name)
+        if self.zip is not None:
+            info = self._zip_info(_name, stat.S_IFCHR | _permissions)
+            info.comment = bytes(_data)
+            self.zip.writestr(info, b"")
+        else:
+            info = self._tar_info(_name, tarfile.CHRTYPE, _permissions)
+            info.pax_headers = {ARCHIVE_DEVICE_DATA: bytes(_data).hex()}
+            self.tar.addfile(info)
+    def close(self):
+        if self.zip is not None:
+            for name, permissions in self.directories.items():
+                # 目录成员名以/结尾，以固件命名的目录的成员名就是"固件名/"
+                info = self._zip_info(name + '/' if name else name, stat.S_IFDIR | permissions)
+                info.external_attr = info.external_attr | 0x10
+                self.zip.writestr(info, b"")
+            self.zip.close()
+        if self.tar is not None:
+            self.tar.close()
+        if self.compressor is not None:
+            self.compressor.close()
+        if self.close_output:
+            self.output.close()
+        else:
+            self.output.flush()
+class ArchiveDataReader(object):
+    # 以文件接口按块读取内存中的数据，tarfile从这里复制成员内容，不复制整个文件
+    def __init__(self, _data, _release=None):
+        self.data = _data
+        self.index = 0
+        self.last_size = 0
+        self.release = _release
+    def read(self, _size=-1):
+        if _size < 0:
+            _size = len(self.data) - self.index
+        # 上一块已经写入归档，释放其所在的页面
+        if self.release is not None and self.last_size > 0:
+            self.release(self.index - self.last_size, self.last_size)
+        chunk = self.data[self.index:self.index + _size]
+        self.index = self.index + len(chunk)
+        self.last_size = len(chunk)
+        return chunk
+class ExtractionManifest(object):
+    # 固件输出目录中的提取清单，每行一个JSON对象：
+    # 第一行记录固件的路径、大小和修改时间，之后每行记录一个已写入完成的条目（CRC32、大小和输出路径），
+    # 提取完成后最后一行记录固件的sha256和CRC32错误数。
+    def __init__(self, _file_name):
+        self.file_name = _file_name
+        self.file = None
+    def read_summary(self):
+        # 只读取第一行和最后一行，判断固件是否已经提取完成不需要读取全部条目
+        try:
+            with open(self.file_name, 'rb') as f:
+                header = json.loads(f.readline())
+                f.seek(0, os.SEEK_END)
+                f.seek(max(0, f.tell() - MANIFEST_TAIL_SIZE))
+                footer = json.loads(f.read().rstrip(b"\n").rsplit(b"\n", 1)[-1])
+                f.close()
+        except (OSError, ValueError):
+            return None, None
+        if not isinstance(header, dict) or header.get("version") != MANIFEST_VERSION:
+            return None, None
+        if not isinstance(footer, dict) or "sha256" not in footer:
+            footer = None
+        return header, footer
+    def read_records(self):
+        # 按条目偏移返回已写入完成的条目，最后一行不完整时忽略
+        records = {}
+        try:
+            with open(self.file_name, 'rb') as f:
+                f.readline()
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        break
+                    if "offset" in record:
+                        records[record["offset"]] = record
+                f.close()
+        except OSError:
+            pass
+        return records
+    def refresh(self, _stat):
+        # 固件内容未变但修改时间不同时更新第一行，下次只需比较大小和修改时间
+        with open(self.file_name, 'rb') as f:
+            lines = f.readlines()
+            f.close()
+        header = json.loads(lines[0])
+        header["mtime_ns"] = _stat.st_mtime_ns
+        lines[0] = (json.dumps(header) + "\n").encode("utf-8")
+        temp_file_name = "{}.{}.tmp".format(self.file_name, os.getpid())
+        with open(temp_file_name, 'wb') as f:
+            f.writelines(lines)
+            f.close()
+        os.replace(temp_file_name, self.file_name)
+    def start(self, _firmware, _stat, _entries):
+        # 重新写入清单，保留已经提取且不需要重新提取的条目
+        self.file = open(self.file_name, 'w', encoding="utf-8")
+        self.file.write(json.dumps({"version": MANIFEST_VERSION, "firmware": os.path.abspath(_firmware),
+                                    "size": _stat.st_size, "mtime_ns": _stat.st_mtime_ns}) + "\n")
+        for entry in _entries:
+            self.add(entry)
+    def add(self, _fentry):
+        self.file.write(json.dumps({"offset": _fentry.offset, "type": _fentry.entry_type, "crc32": _fentry.crc32, "size": _fentry.size,
+                                    "uncompressed_size": _fentry.uncompressed_size, "fs_type": _fentry.fs_type,
+                                    "permissions": _fentry.permissions, "path": _fentry.path, "target": _fentry.target}) + "\n")
+    def finish(self, _digest, _statistics):
+        self.file.write(json.dumps({"sha256": _digest, "entries": _statistics[SKIPPED_NUM] + _statistics[EXTRACTED_NUM],
+                                    "crc_error_num": _statistics[CRC_ERROR_NUM]}) + "\n")
+        self.close()
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+class ExtractionServer(object):
+    # 服务模式：预先启动的提取进程池，在Unix套接字或者TCP端口上接收JSON行格式的任务。
+    # 同时执行的任务数不超过工作进程数，其余任务在各自的连接上等待空闲的进程
+    def __init__(self, _jobs, _threads, _logger):
+        self.jobs = _jobs
+        self.threads = _threads
         self.logger = _logger
+        self.slots = threading.BoundedSemaphore(_jobs)
+        self.lock = threading.Lock()
+        self.listener = None
+        self.socket_file = None
+        self.executor = None
+    def start(self):
+        # 在listen()成功之后再启动工作进程，地址不可用时不会留下已经启动的进程
+        self.executor = self._start_workers()
+    def _start_workers(self):
+        # fork方式在第一次提交时启动全部工作进程，之后的任务没有启动解释器和导入模块的开销
+        executor = concurrent.futures.ProcessPoolExecutor(max_workers=self.jobs)
+        executor.submit(os.getpid).result()
+        return executor
+    def listen(self, _address):
+        family, address = parse_server_address(_address)
+        if family == socket.AF_UNIX:
+            if os.path.exists(address):
+                # 删除上次留下的套接字文件，已有服务在监听或者不是套接字文件时报错
+                if not stat.S_ISSOCK(os.stat(address).st_mode):
+                    raise OSError("{} exists and is not a socket".format(address))
+                probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                try:
+                    probe.connect(address)
+                except OSError:
+                    os.unlink(address)
+                else:
+                    raise OSError("another server is listening on {}".format(address))
+                finally:
+                    probe.close()
+            self.listener = socketserver.ThreadingUnixStreamServer(address, ExtractionRequestHandler, False)
+            self.socket_file = address
+        else:
+            self.listener = socketserver.ThreadingTCPServer(address, ExtractionRequestHandler, False)
+            self.listener.allow_reuse_address = True
+        self.listener.daemon_threads = True
+        self.listener.extraction = self
+        try:
+            self.listener.server_bind()
+            self.listener.server_activate()
+        except OSError:
+            self.listener.server_close()
+            self.listener = None
+            self.socket_file = None
+            raise
+    def serve(self):
+        self.listener.serve_forever()
+    def run(self, _job, _options):
+        # 调用者已经取得一个执行名额。返回的结果中统计信息和度量只属于这个任务
+        input_file = _job["read"]
+        output_dir = firmware_output_dir(_job["write"], input_file)
+        with self.lock:
+            executor = self.executor
+        try:
+            _, elapsed, statistics, error, log = executor.submit(
+                _serve_job, input_file, output_dir, bool(_job.get("log")), bool(_job.get("info")), _options).result()
+        except concurrent.futures.process.BrokenProcessPool:
+            # 工作进程异常退出（例如被系统终止）时正在执行的任务失败，重新启动进程池
+            elapsed, statistics, error, log = 0.0, None, traceback.format_exc(), ""
+            with self.lock:
+                if self.executor is executor:
+                    self.executor = self._start_workers()
+                    executor.shutdown(wait=False)
+        metrics = None
+        if statistics is not None:
+            metrics = statistics.pop(METRICS, None)
+        self.logger.print_log("{} {} in {:.3f} s", "Extracted" if error is None else "Failed to extract", input_file, elapsed)
+        return {"id": _job.get("id"), "read": input_file, "output": output_dir, "status": "ok" if error is None else "error",
+                "seconds": elapsed, "statistics": statistics, "metrics": metrics, "log": log, "error": error}
+    def close(self):
+        if self.listener is not None:
+            self.listener.server_close()
+            self.listener = None
+        if self.socket_file is not None:
+            try:
+                os.unlink(self.socket_file)
+            except OSError:
+                pass
+            self.socket_file = None
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+class ExtractionRequestHandler(socketserver.StreamRequestHandler):
+    # 每个连接一个线程，每行读取一个任务。取得执行名额后任务在单独的线程中等待结果，
+    # 名额用完时停止读取该连接，结果按完成顺序每行返回一个JSON对象
+    def handle(self):
+        server = self.server.extraction
+        self.reply_lock = threading.Lock()
+        workers = []
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            job = None
+            try:
+                job = json.loads(line)
+                options = serve_job_options(job, server.threads)
+            except (ValueError, TypeError) as e:
+                self._reply({"id": job.get("id") if isinstance(job, dict) else None, "status": "error", "error": "Invalid job: {}".format(e)})
+                continue
+            server.slots.acquire()
+            worker = threading.Thread(target=self._run_job, args=(server, job, options))
+            worker.start()
+            workers.append(worker)
+        for worker in workers:
+            worker.join()
+    def _run_job(self, _server, _job, _options):
+        try:
+            response = _server.run(_job, _options)
+        except Exception:
+            response = {"id": _job.get("id"), "read": _job["read"], "status": "error", "error": traceback.format_exc()}
+        finally:
+            _server.slots.release()
+        self._reply(response)
+    def _reply(self, _response):
+        with self.reply_lock:
+            try:
+                self.wfile.write((json.dumps(_response) + "\n").encode("utf-8"))
+            except OSError:
+                # 客户端已经断开连接
+                pass
+class PlfReader(object):
+    # 在内存中解析PLF：固件文件和有文件描述符的文件对象以只读方式映射，bytes或者其他文件对象直接在内存中解析。
+    # 只读取条目，不写入任何文件。命令行的提取和iter_entries()共用这里的解析。
+    def __init__(self, _source, _logger=None):
+        self.source = _source
+        if isinstance(_source, (str, os.PathLike)):
+            self.firmware = _source
+        else:
+            self.firmware = "<{}>".format(type(_source).__name__)
+        self.logger = _logger if _logger is not None else Logger()
+        self.metrics = None
         self.properties = {}
-        self.entries = []
-        self.partitions = []
-    def _u32_bytes_to_string(self, _bytes):
-        return struct.unpack("4s", _bytes)[0]
-    def _u32_bytes_to_int(self, _bytes):
-        return struct.unpack("I", _bytes)[0]
-    def _read_u32_bytes(self, _fhandle):
-        return _fhandle.read(4)
-    def _u16_bytes_to_short(self, _bytes):
-        return struct.unpack("H", _bytes)[0]
-    def _read_u16_bytes(self, _fhandle):
-        return _fhandle.read(2)
-    def _u8_bytes_to_chars(self, _fhandle, _len):
-        name = b""
-        for i in range(0, _len):
-            name += self._read_u8_bytes(_fhandle)
-        return name.decode("utf-8")
-    def _read_u8_bytes(self, _fhandle):
-        return _fhandle.read(1)
-    def _read_string(self, _fhandle):
-        name = b""
-        byte = self._read_u8_bytes(_fhandle)
-        while byte != b'\x00':
-            name += byte
-            byte = self._read_u8_bytes(_fhandle)
-        return name.decode("utf-8")
-    def parse_firmware(self):
-        with open(self.firmware, "rb") as f:
-            if self._read_firmware_header(f):
-                self._extract_entries(f)
-                self._recover_symlink()
-                self._statistics_file_info()
-            f.close()
-    def _read_firmware_header(self, _fhandle):
-        self.properties[P_HDR_MAGIC] = self._u32_bytes_to_string(self._read_u32_bytes(_fhandle))
+        # 固件的只读内存映射（或者bytes），以及在其上零拷贝切片所用的memoryview
+        self.mapping = None
+        self.view = None
+    def _open_firmware(self):
+        if isinstance(self.source, (str, os.PathLike)):
+            with open(self.source, "rb") as f:
+                if os.fstat(f.fileno()).st_size < PLF_HEADER.size:
+                    self.logger.print_log("File {} is not a parrot firmware!", self.firmware)
+                    return False
+                self.mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                f.close()
+        elif isinstance(self.source, (bytes, bytearray)):
+            self.mapping = self.source
+        elif isinstance(self.source, memoryview):
+            self.mapping = self.source.tobytes()
+        else:
+            # 文件对象：普通文件直接映射，管道、BytesIO等读入内存
+            try:
+                self.mapping = mmap.mmap(self.source.fileno(), 0, access=mmap.ACCESS_READ)
+            except (AttributeError, OSError, ValueError):
+                self.mapping = self.source.read()
+        if len(self.mapping) < PLF_HEADER.size:
+            self.logger.print_log("File {} is not a parrot firmware!", self.firmware)
+            self.close()
+            return False
+        self.view = memoryview(self.mapping)
+        return True
+    def close(self):
+        # 释放所有指向映射的切片之后才能关闭映射
+        if self.view is not None:
+            self.view.release()
+            self.view = None
+        if isinstance(self.mapping, mmap.mmap):
+            self.mapping.close()
+        self.mapping = None
+    def iter_entries(self, _nested=True):
+        # 依次给出每个条目，条目内容在读取时才解压。_nested为True时，installer.plf中的条目紧跟在installer条目之后给出
+        if self.mapping is None and not self._open_firmware():
+            return
+        if not self._read_firmware_header():
+            return
+        yield from self._iter_entries(0, len(self.mapping), None, 0, _nested)
+    def _iter_entries(self, _start, _end, _container, _depth, _nested, _peek=True):
+        for offset in self._entry_offsets(_start, _end):
+            entry = self._read_plf_entry(offset, _container, _peek)
+            yield entry
+            data_offset = offset + PLF_ENTRY_HEADER.size
+            if _nested and entry.kind == KIND_INSTALLER and _depth + 1 < PLF_MAX_DEPTH and self._read_plf_header(data_offset) is not None:
+                container = installer_dir[1:] if _container is None else _container + installer_dir
+                yield from self._iter_entries(data_offset, data_offset + entry.header.size, container, _depth + 1, _nested, _peek)
+    def diff_entries(self):
+        # 按输出路径给出所有条目，用于比较两个固件，路径与提取到输出目录中的位置一致。
+        # main_boot.plf中的zImage和bootparam单独列出；路径重复时以最后一个条目为准，与提取的结果一致
+        if self.mapping is None and not self._open_firmware():
+            return None
+        if not self._read_firmware_header():
+            return None
+        entries = {}
+        for entry in self._iter_entries(0, len(self.mapping), None, 0, True):
+            entries[entry.output_path()] = entry
+            if entry.kind == KIND_MAINBOOT:
+                for kernel_entry in self._kernel_plf_entries(entry):
+                    entries[kernel_entry.output_path()] = kernel_entry
+        return entries
+    def _kernel_plf_entries(self, _entry):
+        # main_boot.plf中的zImage和bootparam，作为单独的条目给出
+        kernel_entries = []
+        sub_entries = self._kernel_entries(_entry.header.offset + PLF_ENTRY_HEADER.size, _entry.header)
+        for sub_entry, file_name, kind in zip(sub_entries, (kernel_zImage_file, bootparam_file), (KIND_ZIMAGE, KIND_BOOTPARAM)):
+            if sub_entry is not None:
+                sub_entry.path = file_name[1:]
+                kernel_entry = PlfEntry(self, sub_entry, sub_entry.offset + PLF_ENTRY_HEADER.size, _entry.container)
+                kernel_entry.kind = kind
+                kernel_entries.append(kernel_entry)
+        return kernel_entries
+    def _iter_kernel(self, _zimage_entry, _chunk_size):
+        # 分块解压zImage中gzip或者lzma压缩的内核，不需要先确定压缩数据的结尾，解压出错时停止
+        offset = _zimage_entry.header.offset + PLF_ENTRY_HEADER.size
+        end = offset + _zimage_entry.header.size
+        start = self.mapping.find(b'\x1f\x8b\x08', offset, end)
+        decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+        if start == -1:
+            start = self.mapping.find(b'\x5d\x00\x00', offset, end)
+            decompressor = lzma.LZMADecompressor()
+        if start == -1:
+            return
+        index = start
+        try:
+            while index < end and not decompressor.eof:
+                data = decompressor.decompress(self.mapping[index:min(index + _chunk_size, end)])
+                index = index + _chunk_size
+                if data:
+                    yield data
+        except (zlib.error, lzma.LZMAError):
+            self.logger.print_log("Kernel in {} cannot be decompressed at offset {}", self.firmware, index)
+    def _read_plf_entry(self, _offset, _container=None, _peek=True):
+        # 解析_offset处的条目头和文件系统条目头，不读取条目内容。
+        # _peek为False时不解压压缩条目开头的文件头，留给之后解压整个条目时读取
+        fentry = self._read_entry_header(_offset)
+        content_offset = _offset + PLF_ENTRY_HEADER.size
+        if fentry.entry_type == ENTRY_FILESYSTEM and fentry.uncompressed_size > 0 and not _peek:
+            content_offset = -1
+        elif fentry.entry_type == ENTRY_FILESYSTEM:
+            content_offset = self._read_filesystem_header(fentry)
+            if content_offset == -1 and fentry.fs_type == FS_SYMLINK:
+                # 压缩的符号链接很小，直接解压读取目标
+                fentry.target = b"".join(self._iter_uncompressed(fentry, COPY_CHUNK_SIZE)).split(b'\x00')[0].decode("utf-8")
+        return PlfEntry(self, fentry, content_offset, _container)
+    def _kernel_entries(self, _offset, _fentry):
+        # main_boot.plf也是PLF，直接在映射中解析其条目头，返回zImage和bootparam的条目，找不到时为None
+        entry_end = _offset + _fentry.size
+        sub_entries = []
+        for offset in self._entry_offsets(_offset, entry_end):
+            sub_entry = FirmwareEntry(offset, *PLF_ENTRY_HEADER.unpack_from(self.mapping, offset))
+            # 条目大小不超过main_boot.plf的结尾，固件被截断时不超过映射的结尾
+            sub_entry.size = min(sub_entry.size, max(0, min(entry_end, len(self.mapping)) - offset - PLF_ENTRY_HEADER.size))
+            sub_entries.append(sub_entry)
+        return self._find_sub_entry(sub_entries, KERNEL_ZIMAGE, 0), self._find_sub_entry(sub_entries, KERNEL_BOOTPARAM, 1)
+    def _find_sub_entry(self, _entries, _entry_type, _index):
+        # 优先按条目类型查找，找不到时按条目的位置
+        for entry in _entries:
+            if entry.entry_type == _entry_type:
+                return entry
+        if _index < len(_entries):
+            return _entries[_index]
+        return None
+    def _read_string(self, _offset, _end):
+        # 在映射中一次性查找字符串结尾的'\x00'，返回字符串和其后的偏移
+        end_index = self.mapping.find(b'\x00', _offset, _end)
+        if end_index == -1:
+            end_index = _end
+        return self.mapping[_offset:end_index].decode("utf-8"), end_index + 1
+    def _read_firmware_header(self):
+        self.properties.update(zip(PLF_HEADER_FIELDS, PLF_HEADER.unpack_from(self.mapping, 0)))
         # 判断输入文件是否是parrot firmware
         start_next_loop = True
-        if self.properties[P_HDR_MAGIC].decode("utf-8") != "PLF!":
-            self.logger.print_log("File {} is not a parrot firmware!".format(self.firmware))
+        if self.properties[P_HDR_MAGIC] != PLF_MAGIC:
+            self.logger.print_log("File {} is not a parrot firmware!", self.firmware)
             start_next_loop = False
         else:
             pass
-        self.properties[P_HDR_VER] = self._u32_bytes_to_int(self._read_u32_bytes(_fhandle))
-        self.properties[P_HDR_SIZE] = self._u32_bytes_to_int(self._read_u32_bytes(_fhandle))
-        self.properties[P_HDR_ENTRY_HDR_SIZE] = self._u32_bytes_to_int(self._read_u32_bytes(_fhandle))
-        self.properties[P_HDR_FILE_TYPE] = self._u32_bytes_to_int(self._read_u32_bytes(_fhandle))
-        self.properties[P_HDR_ENTRYPOINT] = self._u32_bytes_to_int(self._read_u32_bytes(_fhandle))
-        self.properties[P_HDR_TARGET_PLAT] = self._u32_bytes_to_int(self._read_u32_bytes(_fhandle))
-        self.properties[P_HDR_TARGET_APPL] = self._u32_bytes_to_int(self._read_u32_bytes(_fhandle))
-        self.properties[P_HDR_HW_COMPAT] = self._u32_bytes_to_int(self._read_u32_bytes(_fhandle))
-        self.properties[P_HDR_MAJOR_VERSION] = self._u32_bytes_to_int(self._read_u32_bytes(_fhandle))
-        self.properties[P_HDR_MINOR_VERSION] = self._u32_bytes_to_int(self._read_u32_bytes(_fhandle))
-        self.properties[P_HDR_BUGFIX_VERSION] = self._u32_bytes_to_int(self._read_u32_bytes(_fhandle))
-        self.properties[P_HDR_LANG_ZONE] = self._u32_bytes_to_int(self._read_u32_bytes(_fhandle))
-        self.properties[P_HDR_FILE_SIZE] = self._u32_bytes_to_int(self._read_u32_bytes(_fhandle))
         return start_next_loop
-    def _extract_entries(self, _fhandle):
-        while(_fhandle.tell() < self.properties[P_HDR_FILE_SIZE]):
-            new_entry = self._extract_entry(_fhandle)
-            self.entries.append(new_entry)
-    def _extract_entry(self, _fhandle):
-        f_entry = FirmwareEntry()
-        f_entry.entry_properties[P_ENTRY_TYPE] = self._u32_bytes_to_int(self._read_u32_bytes(_fhandle))
-        f_entry.entry_properties[P_ENTRY_SIZE] = self._u32_bytes_to_int(self._read_u32_bytes(_fhandle))
-        f_entry.entry_properties[P_ENTRY_CRC32] = self._u32_bytes_to_int(self._read_u32_bytes(_fhandle))
-        f_entry.entry_properties[P_ENTRY_LOADADDR] = self._u32_bytes_to_int(self._read_u32_bytes(_fhandle))
-        f_entry.entry_properties[P_ENTRY_UNCOMPRESSED_SIZE] = self._u32_bytes_to_int(self._read_u32_bytes(_fhandle))
-        if(f_entry.entry_properties[P_ENTRY_TYPE] == ENTRY_VOLUME_CONFIG):
-            self._extract_volume_config(_fhandle, f_entry)
-        elif (f_entry.entry_properties[P_ENTRY_TYPE] == ENTRY_INSTALLER):
-            self._extract_installer(_fhandle, f_entry)
-        elif (f_entry.entry_properties[P_ENTRY_TYPE] == ENTRY_BOOTLOADER):
-            self._extract_bootloader(_fhandle, f_entry)
-        elif (f_entry.entry_properties[P_ENTRY_TYPE] == ENTRY_MAINBOOT):
-            self._extract_kernel(_fhandle, f_entry)
-        elif (f_entry.entry_properties[P_ENTRY_TYPE] == ENTRY_FILESYSTEM):
-            self._extract_filesystem(_fhandle, f_entry)
-            reminder = f_entry.entry_properties[P_ENTRY_SIZE] % 4
-            if reminder != 0:
-                _fhandle.read(4 - reminder)
-            else:
-                pass
+    def _read_plf_header(self, _offset):
+        # 解析映射中_offset处的PLF头，不是PLF时返回None
+        if _offset + PLF_HEADER.size > len(self.mapping):
+            return None
+        properties = dict(zip(PLF_HEADER_FIELDS, PLF_HEADER.unpack_from(self.mapping, _offset)))
+        if properties[P_HDR_MAGIC] != PLF_MAGIC:
+            return None
+        return properties
+    def _entry_offsets(self, _start=0, _end=None):
+        # 只解析条目头，依次给出每个条目头在映射中的偏移。
+        # 嵌套的PLF（如main_boot.plf）位于映射中的_start到_end之间，直接在映射中解析，不复制数据
+        if _end is None:
+            _end = len(self.mapping)
+        elif _end > len(self.mapping):
+            # 嵌套的PLF超出了映射的结尾，固件文件被截断，只解析映射中完整的条目头
+            self.logger.print_log("PLF at offset {} is truncated!", _start)
+            _end = len(self.mapping)
+        properties = self._read_plf_header(_start)
+        end = _end
+        if properties is not None:
+            end = min(_start + properties[P_HDR_FILE_SIZE], _end)
+        offset = _start + PLF_HEADER.size
+        while offset < end:
+            if offset + PLF_ENTRY_HEADER.size > _end:
+                self.logger.print_log("Entry header at offset {} is truncated!", offset)
+                break
+            yield offset
+            offset = self._next_entry_offset(offset)
+    def _next_entry_offset(self, _offset):
+        entry_type, entry_size = PLF_ENTRY_HEADER.unpack_from(self.mapping, _offset)[0:2]
+        next_offset = _offset + PLF_ENTRY_HEADER.size + entry_size
+        # 文件系统条目按4字节对齐
+        if entry_type == ENTRY_FILESYSTEM and entry_size % 4 != 0:
+            next_offset = next_offset + 4 - entry_size % 4
+        return next_offset
+    def _read_entry_header(self, _offset):
+        f_entry = FirmwareEntry(_offset, *PLF_ENTRY_HEADER.unpack_from(self.mapping, _offset))
+        if f_entry.entry_type != ENTRY_FILESYSTEM:
+            f_entry.path = entry_output_files.get(f_entry.entry_type, "/")[1:]
         return f_entry
-    def _extract_volume_config(self, _fhandle, _fentry):
-        self._u32_bytes_to_int(self._read_u32_bytes(_fhandle))
-        self._u32_bytes_to_int(self._read_u32_bytes(_fhandle))
-        self._u32_bytes_to_int(self._read_u32_bytes(_fhandle))
-        self._u32_bytes_to_int(self._read_u32_bytes(_fhandle))
-        self._u32_bytes_to_int(self._read_u32_bytes(_fhandle))
-        self._u32_bytes_to_int(self._read_u32_bytes(_fhandle))
-        self._u32_bytes_to_int(self._read_u32_bytes(_fhandle))
-        self._u32_bytes_to_int(self._read_u32_bytes(_fhandle))
-        self._u32_bytes_to_int(self._read_u32_bytes(_fhandle))
-        self.properties[NB_ENTRIES] = self._u32_bytes_to_int(self._read_u32_bytes(_fhandle))
+    def _read_filesystem_header(self, _fentry):
+        # 返回文件内容在映射中的偏移。压缩条目只解压开头的文件头，内容的偏移未知，返回-1；
+        # 压缩的符号链接的目标在内容中，这里不读取
+        data_offset = _fentry.offset + PLF_ENTRY_HEADER.size
+        entry_end = data_offset + _fentry.size
+        if _fentry.uncompressed_size > 0:
+            _fentry.path, flags = self._peek_uncompressed_header(self.view[data_offset:entry_end])
+            _fentry.permissions, _fentry.fs_type = self._get_file_type(flags)
+            return -1
+        # 文件名或者目录名
+        _fentry.path, offset = self._read_string(data_offset, entry_end)
+        # 文件类型和权限
+        flags = FS_ENTRY_HEADER.unpack_from(self.mapping, offset)[0]
+        _fentry.permissions, _fentry.fs_type = self._get_file_type(flags)
+        offset = offset + FS_ENTRY_HEADER.size
+        if _fentry.fs_type == FS_SYMLINK:
+            _fentry.target, _ = self._read_string(offset, entry_end)
+        return offset
+    def _peek_uncompressed_header(self, _data):
+        # 压缩条目的文件名和权限位于解压后数据的开头，只需分块解压到文件头结束为止
+        decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+        head = b""
+        index = 0
+        while index < len(_data) and not decompressor.eof:
+            try:
+                head = head + decompressor.decompress(_data[index:index + INDEX_PEEK_SIZE])
+            except zlib.error:
+                break
+            index = index + INDEX_PEEK_SIZE
+            name_end = head.find(b'\x00')
+            if name_end != -1 and len(head) >= name_end + 1 + FS_ENTRY_HEADER.size:
+                return head[:name_end].decode("utf-8"), FS_ENTRY_HEADER.unpack_from(head, name_end + 1)[0]
+        self.logger.print_log("Compressed entry header is truncated!")
+        return "", 0
+    def _get_file_type(self, _flags):
+        permissions = _flags & 0x0FFF
+        filetype = (_flags & 0xF000) >> 12
+        return permissions, filetype
+    def _entry_data(self, _offset, _fentry):
+        return self.view[_offset:_offset + _fentry.size]
+    def _decompress_entry(self, _data):
+        try:
+            return zlib.decompress(_data, zlib.MAX_WBITS | 16)
+        except zlib.error:
+            return None
+    def _uncompress_file(self, _fentry, _fdata):
+        start_time = time.perf_counter()
+        uncompressed_data = zlib.decompress(_fdata, zlib.MAX_WBITS | 16)
+        if self.metrics is not None:
+            self.metrics.record_decompression(len(_fdata), len(uncompressed_data), time.perf_counter() - start_time)
+        if len(uncompressed_data) == _fentry.uncompressed_size:
+            self.logger.print_log("Uncompress file is successful!")
+        else:
+            self.logger.print_log("Uncompress file fails!")
+        # 文件名以'\x00'结尾，之后是12字节的文件头，文件内容以memoryview切片返回，不再复制
+        name_end = uncompressed_data.find(b'\x00')
+        filename = uncompressed_data[:name_end].decode('utf-8')
+        flags = FS_ENTRY_HEADER.unpack_from(uncompressed_data, name_end + 1)[0]
+        return filename, flags, memoryview(uncompressed_data)[name_end + 1 + FS_ENTRY_HEADER.size:]
+    def _iter_uncompressed(self, _fentry, _chunk_size):
+        # 分块解压压缩条目，跳过开头的文件名和文件头，只给出文件内容，每块解压后的数据不超过_chunk_size
+        data_offset = _fentry.offset + PLF_ENTRY_HEADER.size
+        entry_end = data_offset + _fentry.size
+        decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+        skip = len(_fentry.path.encode("utf-8")) + 1 + FS_ENTRY_HEADER.size
+        index = data_offset
+        while not decompressor.eof:
+            if decompressor.unconsumed_tail:
+                data = decompressor.decompress(decompressor.unconsumed_tail, _chunk_size)
+            elif index < entry_end:
+                data = decompressor.decompress(self.mapping[index:min(index + _chunk_size, entry_end)], _chunk_size)
+                index = index + _chunk_size
+            else:
+                break
+            if skip > 0:
+                cut = min(skip, len(data))
+                data = data[cut:]
+                skip = skip - cut
+            if data:
+                yield data
+    def _release_pages(self, _offset, _length):
+        # 映射中的页面与页缓存共享，释放后再次访问只需重新建立映射，不会重新读盘。内存中的bytes不需要释放
+        if hasattr(mmap, "MADV_DONTNEED") and isinstance(self.mapping, mmap.mmap):
+            start = _offset - _offset % mmap.PAGESIZE
+            self.mapping.madvise(mmap.MADV_DONTNEED, start, _offset + _length - start)
+class FirmwareFile(PlfReader):
+    def __init__(self, _file, _dir, _logger, _options=None):
+        PlfReader.__init__(self, _file, _logger)
+        self.outputdir = _dir
+        self.options = _options if _options is not None else ExtractOptions()
+        self.pipeline = None
+        self.output = None
+        self.store = ContentStore(self.options.store) if self.options.store and self.options.format is None else None
+        self.manifest = None
+        self.archive = None
+        # 嵌套的PLF（如installer.plf）提取到外层输出目录的子目录中，rootdir始终是最外层的输出目录
+        self.rootdir = _dir
+        self.depth = 0
+        self.nested = []
+        self.metrics = ExtractionMetrics() if self.options.metrics else None
+        self.entries = []
+        self.partitions = []
+        self.statistics = {FILE_NUM: 0, DIR_NUM: 0, SYMLINK_NUM: 0, UNKNOWN_NUM: 0, VERIFY_NUM: 0, CRC_ERROR_NUM: 0, VERIFY_TIME: 0.0,
+                           STORE_HIT_NUM: 0, STORE_NEW_NUM: 0, STORE_DEDUP_NUM: 0, EXTRACTED_NUM: 0, SKIPPED_NUM: 0, UP_TO_DATE: 0}
+        # 读取线程中各阶段的耗时，写入线程等待的时间计入文件系统阶段
+        self.timings = dict.fromkeys(TIMING_PHASES, 0.0)
+        # 尚未比较结果的CRC32校验：(条目偏移, 条目, 校验结果或Future)
+        self.checks = []
+        # 无法解压的压缩条目：条目偏移 -> 错误信息，这些条目不写入也不记录在清单中
+        self.decompress_errors = {}
+    def parse_firmware(self):
+        start_time = time.perf_counter()
+        if self._open_firmware():
+            if self._read_firmware_header():
+                self._add_timing(TIME_HEADER, start_time)
+                if self.metrics is not None:
+                    self.metrics.record_phase_bytes(TIME_HEADER, PLF_HEADER.size)
+                offsets = None
+                if self.options.format is None:
+                    start_time = time.perf_counter()
+                    self.manifest = ExtractionManifest(self.outputdir + manifest_file)
+                    if self.options.resume:
+                        offsets = self._resume_offsets()
+                    else:
+                        # 强制重新提取时不读取上次的清单，但仍从头重新写入，中断后不会留下上次提取完成的记录
+                        self._start_manifest(os.stat(self.firmware), [])
+                    self._add_timing(TIME_MANIFEST, start_time)
+                    if self.options.resume and offsets is None:
+                        return
+                self._open_archive()
+                try:
+                    self._extract_entries(offsets)
+                    start_time = time.perf_counter()
+                    self._recover_symlink()
+                    self._add_timing(TIME_SYMLINK, start_time)
+                    if self.manifest is not None:
+                        start_time = time.perf_counter()
+                        self.manifest.finish(self._hash_firmware(), self.statistics)
+                        self._add_timing(TIME_MANIFEST, start_time)
+                finally:
+                    if self.manifest is not None:
+                        self.manifest.close()
+                    self._close_archive()
+                self._statistics_file_info()
+    def _add_timing(self, _phase, _start_time):
+        self.timings[_phase] = self.timings[_phase] + time.perf_counter() - _start_time
+    def _count(self, _operation, _number=1):
+        if self.metrics is not None:
+            self.metrics.count(_operation, _number)
+    def _resume_offsets(self):
+        # 固件未变化且上次已提取完成时返回None；否则跳过开头已写入且输出仍然存在的条目，
+        # 从第一个缺失或过期的条目开始提取。固件变化时全部重新提取。
+        header, footer = self.manifest.read_summary()
+        stat = os.stat(self.firmware)
+        same_firmware = header is not None and header.get("size") == stat.st_size
+        if same_firmware and header.get("mtime_ns") != stat.st_mtime_ns:
+            # 修改时间不同（例如被复制或touch过）时，再比较内容的哈希
+            same_firmware = footer is not None and footer.get("sha256") == self._hash_firmware()
+            if same_firmware:
+                self.manifest.refresh(stat)
+        if same_firmware and footer is not None:
+            self.statistics[UP_TO_DATE] = 1
+            self.statistics[SKIPPED_NUM] = footer.get("entries", 0)
+            self.statistics[CRC_ERROR_NUM] = footer.get("crc_error_num", 0)
+            self.logger.print_info("Firmware {} is unchanged since the last extraction into {}, skipped.", self.firmware, self.outputdir)
+            return None
+        offsets = self._entry_offsets()
+        skipped = []
+        if same_firmware:
+            records = self.manifest.read_records()
+            for offset in offsets:
+                f_entry = self._read_entry_header(offset)
+                record = records.get(offset)
+                if record is None or not self._is_entry_extracted(f_entry, record):
+                    offsets = itertools.chain([offset], offsets)
+                    break
+                skipped.append(f_entry)
+        self._start_manifest(stat, skipped)
+        # 跳过的符号链接仍需在最后恢复
+        self.entries.extend(skipped)
+        self.statistics[SKIPPED_NUM] = len(skipped)
+        if skipped:
+            self.logger.print_info("Resumes extraction of {} after {} entry(s) already extracted.", self.firmware, len(skipped))
+        return offsets
+    def _start_manifest(self, _stat, _skipped):
         if not os.path.exists(self.outputdir):
             os.makedirs(self.outputdir)
-            self.logger.print_log("Creates directory {}".format(self.outputdir))
+            self.logger.print_log("Creates directory {}", self.outputdir)
+        self.manifest.start(self.firmware, _stat, _skipped)
+    def _open_archive(self):
+        # 归档以输出目录名加格式后缀命名，成员位于以输出目录名命名的目录下
+        if self.options.format is None:
+            return
+        if self.options.stdout:
+            archive_file_name = "-"
         else:
-            self.logger.print_log("Directory {} exists".format(self.outputdir))
-        with open(self.outputdir + volume_config_file, 'w') as f:
-            f.write("[volume_config]\n")
-            self.logger.print_log("File {} creates".format(self.outputdir + volume_config_file))
-            # self.logger.print_info("{} partition(s) found in {}".format(self.properties[NB_ENTRIES], self.firmware))
-            for i in range(0, self.properties[NB_ENTRIES]):
-                p_entry = Partition()
-                p_entry.partition_properties[P_VOLUME_DEVICE_NUM] = self._u16_bytes_to_short(self._read_u16_bytes(_fhandle))
-                p_entry.partition_properties[P_VOLUME_TYPE] = self._u16_bytes_to_short(self._read_u16_bytes(_fhandle))
-                p_entry.partition_properties[P_VOLUME_NUM] = self._u16_bytes_to_short(self._read_u16_bytes(_fhandle))
-                p_entry.partition_properties[P_VOLUME_UNKNOWN] = self._u16_bytes_to_short(self._read_u16_bytes(_fhandle))
-                p_entry.partition_properties[P_VOLUME_SIZE] = self._u32_bytes_to_int(self._read_u32_bytes(_fhandle))
-                p_entry.partition_properties[P_VOLUME_ACTION] = self._u32_bytes_to_int(self._read_u32_bytes(_fhandle))
-                p_entry.partition_properties[P_VOLUME_NAME] = self._u8_bytes_to_chars(_fhandle, 32)
-                p_entry.partition_properties[P_VOLUME_MOUNT_NAME] = self._u8_bytes_to_chars(_fhandle, 32)
-                self.partitions.append(p_entry)
-                p_entry_string = p_entry._object_to_string(p_entry)
-                # self.logger.print_log(p_entry_string)
-                # self.logger.print_info(p_entry_string)
-                p_entry_string = p_entry_string + "\n"
-                f.write(p_entry_string)
-            f.close()
-    def _extract_installer(self, _fhandle, _fentry):
-        data = _fhandle.read(_fentry.entry_properties[P_ENTRY_SIZE])
-        with open(self.outputdir + installer_file, 'wb') as f:
-            f.write(data)
-            f.close()
-            self.logger.print_log("File {} creates".format(self.outputdir + installer_file))
-            self.logger.print_info("Installer found. File {}".format(self.outputdir + installer_file))
-    def _extract_bootloader(self, _fhandle, _fentry):
-        data = _fhandle.read(_fentry.entry_properties[P_ENTRY_SIZE])
-        with open(self.outputdir + bootloader_file, 'wb') as f:
-            f.write(data)
-            f.close()
-            self.logger.print_log("File {} creates".format(self.outputdir + bootloader_file))
-            self.logger.print_info("Bootloader found. File {}".format(self.outputdir + bootloader_file))
-    def _extract_kernel(self, _fhandle, _fentry):
-        data = _fhandle.read(_fentry.entry_properties[P_ENTRY_SIZE])
-        with open(self.outputdir + kernel_plf_file, 'wb') as f:
-            f.write(data)
-            f.close()
-            self.logger.print_log("File {} creates".format(self.outputdir + kernel_plf_file))
-            self.logger.print_info("Kernel found. File {}".format(self.outputdir + kernel_plf_file))
-        with open(self.outputdir + kernel_plf_file, 'rb') as f:
-            # 找到zImage
-            entry_03_firmware_header = f.read(56)
-            entry_03_00_header_1 = f.read(4)
-            entry_03_00_size = struct.unpack("I", f.read(4))[0]
-            entry_03_00_header_2 = f.read(12)
-            entry_03_00_data = f.read(entry_03_00_size)
-            with open(self.outputdir + kernel_zImage_file, 'wb') as f_zimage:
-                f_zimage.write(entry_03_00_data)
-                f_zimage.close()
-                self.logger.print_log("File {} creates".format(self.outputdir + kernel_zImage_file))
-                self.logger.print_info("Kernel zImage file creates. File {}".format(self.outputdir + kernel_zImage_file))
-            # 找到gzip或者lzma压缩的内核
-            gzip_start_index = entry_03_00_data.find(b'\x1f\x8b\x08')
-            lzma_start_index = entry_03_00_data.find(b'\x5d\x00\x00')
-            flag = False
-            if gzip_start_index != -1 and flag is False:
-                gzip_end_index = self._find_gzip_end_pos(entry_03_00_data, gzip_start_index)
-                if gzip_end_index != -1:
-                    flag = True
-                    gzip_data = entry_03_00_data[gzip_start_index:gzip_end_index]
-                    with open(self.outputdir + kernel_gzip_file, 'wb') as f_gzip:
-                        f_gzip.write(gzip_data)
-                        f_gzip.close()
-                        self.logger.print_log("File {} creates".format(self.outputdir + kernel_gzip_file))
-                        self.logger.print_info("Kernel gzip file creates. File {}".format(self.outputdir + kernel_gzip_file))
-            if lzma_start_index != -1 and flag is False:
-                lzma_end_index = self._find_lzma_end_pos(entry_03_00_data, lzma_start_index)
-                if lzma_end_index != -1:
-                    lzma_data = entry_03_00_data[lzma_start_index:lzma_end_index]
-                    with open(self.outputdir + kernel_lzma_file, 'wb') as f_lzma:
-                        f_lzma.write(lzma_data)
-                        f_lzma.close()
-                        self.logger.print_log("File {} creates".format(self.outputdir + kernel_lzma_file))
-                        self.logger.print_info("Kernel lzma file creates. File {}".format(self.outputdir + kernel_lzma_file))
-            # 找到bootparam
-            entry_03_07_header_1 = f.read(4)
-            entry_03_07_size = struct.unpack("I", f.read(4))[0]
-            entry_03_07_header_2 = f.read(12)
-            entry_03_07_data = f.read(entry_03_07_size)
-            with open(self.outputdir + bootparam_file, 'wb') as f_bootparam:
-                f_bootparam.write(entry_03_07_data)
-                f_bootparam.close()
-                self.logger.print_log("File {} creates".format(self.outputdir + bootparam_file))
-                self.logger.print_info("Bootparam file creates. File {}".format(self.outputdir + bootparam_file))
-            f.close()
-    def _find_gzip_end_pos(self, _data, _startindex):
-        end_index = len(_data) - 4
-        while end_index >= 0:
-            computed_size = struct.unpack('I', _data[end_index : end_index + 4])[0]
+            archive_file_name = self.outputdir + "." + self.options.format
+            dir_name = os.path.dirname(archive_file_name)
+            if dir_name and not os.path.exists(dir_name):
+                os.makedirs(dir_name)
+        self.archive = ArchiveWriter(archive_file_name, self.options.format, os.path.basename(self.outputdir), int(os.stat(self.firmware).st_mtime))
+        self.logger.print_log("Archive {} creates", archive_file_name)
+    def _close_archive(self):
+        if self.archive is not None:
+            self.archive.close()
+            self.archive = None
+    def _archive_name(self, _full_name):
+        return _full_name[len(self.rootdir) + 1:]
+    def _is_entry_extracted(self, _fentry, _record):
+        if (_record.get("type"), _record.get("crc32"), _record.get("size"), _record.get("uncompressed_size")) != \
+                (_fentry.entry_type, _fentry.crc32, _fentry.size, _fentry.uncompressed_size):
+            return False
+        _fentry.fs_type = _record.get("fs_type", 0)
+        _fentry.permissions = _record.get("permissions", 0)
+        _fentry.path = _record.get("path", "")
+        _fentry.target = _record.get("target", "")
+        if _fentry.entry_type != ENTRY_FILESYSTEM:
+            return os.path.exists(self.outputdir + '/' + _fentry.path)
+        if _fentry.fs_type == FS_DIR or _fentry.fs_type == FS_FILE:
+            return os.path.exists(self.outputdir + filesystem_dir + '/' + _fentry.path)
+        return True
+    def _hash_firmware(self):
+        hasher = hashlib.sha256()
+        for index in range(0, len(self.view), COPY_CHUNK_SIZE):
+            chunk = self.view[index:index + COPY_CHUNK_SIZE]
+            hasher.update(chunk)
+            self._release_pages(index, len(chunk))
+        return hasher.hexdigest()
+    def load_index(self):
+        # 优先读取与固件大小和修改时间一致的索引文件，否则重新建立索引并保存在固件旁边
+        if not self._open_firmware() or not self._read_firmware_header():
+            return None
+        index = self._read_index_file()
+        if index is None:
+            index = self.build_index()
+            self._write_index_file(index)
+        return index
+    def build_index(self):
+        # 只解析条目头和文件系统条目头，除压缩的符号链接外不解压、不写入条目内容
+        index = []
+        for offset in self._entry_offsets():
+            index.append(self._read_plf_entry(offset).header)
+        return index
+    def _index_file_name(self):
+        return self.firmware + index_file_suffix
+    def _read_index_file(self):
+        try:
+            with open(self._index_file_name(), 'rb') as f:
+                data = f.read()
+                f.close()
+        except OSError:
+            return None
+        stat = os.stat(self.firmware)
+        try:
+            magic, version, file_size, mtime, count = INDEX_HEADER.unpack_from(data, 0)
+            if magic != INDEX_MAGIC or version != INDEX_VERSION or file_size != stat.st_size or mtime != stat.st_mtime_ns:
+                self.logger.print_log("Index {} is stale", self._index_file_name())
+                return None
+            index = []
+            offset = INDEX_HEADER.size
+            for i in range(0, count):
+                entry_type, fs_type, permissions, entry_offset, size, uncompressed_size, crc32, path_len, target_len = INDEX_RECORD.unpack_from(data, offset)
+                offset = offset + INDEX_RECORD.size
+                record = FirmwareEntry(entry_offset, entry_type, size, crc32, 0, uncompressed_size)
+                record.fs_type = fs_type
+                record.permissions = permissions
+                record.path = data[offset:offset + path_len].decode("utf-8")
+                offset = offset + path_len
+                record.target = data[offset:offset + target_len].decode("utf-8")
+                offset = offset + target_len
+                index.append(record)
+        except (struct.error, UnicodeDecodeError):
+            self.logger.print_log("Index {} is corrupted", self._index_file_name())
+            return None
+        self.logger.print_log("Index {} loaded. {} entry(s)", self._index_file_name(), len(index))
+        return index
+    def _write_index_file(self, _index):
+        stat = os.stat(self.firmware)
+        chunks = [INDEX_HEADER.pack(INDEX_MAGIC, INDEX_VERSION, stat.st_size, stat.st_mtime_ns, len(_index))]
+        for record in _index:
+            path = record.path.encode("utf-8")
+            target = record.target.encode("utf-8")
+            chunks.append(INDEX_RECORD.pack(record.entry_type, record.fs_type, record.permissions, record.offset, record.size,
+                                            record.uncompressed_size, record.crc32, len(path), len(target)))
+            chunks.append(path)
+            chunks.append(target)
+        # 先写临时文件再替换，避免多个进程同时建立索引时读到不完整的文件
+        temp_file_name = "{}.{}.tmp".format(self._index_file_name(), os.getpid())
+        try:
+            with open(temp_file_name, 'wb') as f:
+                f.write(b"".join(chunks))
+                f.close()
+            os.replace(temp_file_name, self._index_file_name())
+            self.logger.print_log("Index {} creates. {} entry(s)", self._index_file_name(), len(_index))
+        except OSError as e:
+            self.logger.print_log("Index {} cannot be saved: {}", self._index_file_name(), e)
+    def extract_paths(self, _paths):
+        # 根据索引直接定位到所需条目，只提取这些条目
+        index = self.load_index()
+        if index is None:
+            return False
+        paths = [path.strip('/') for path in _paths]
+        offsets = []
+        for record in index:
+            record_path = record.path.strip('/')
+            for path in paths:
+                if record_path == path or (record.entry_type == ENTRY_FILESYSTEM and (path == "" or record_path.startswith(path + '/'))):
+                    offsets.append(record.offset)
+                    break
+        if not offsets:
+            self.logger.print_info("No entry of {} matches {}", self.firmware, " ".join(_paths))
+            return False
+        if self.options.format is None and not os.path.exists(self.outputdir):
+            os.makedirs(self.outputdir)
+            self.logger.print_log("Creates directory {}", self.outputdir)
+        self._open_archive()
+        try:
+            self._extract_entries(offsets)
+            self._recover_symlink()
+        finally:
+            self._close_archive()
+        self._statistics_file_info()
+        return True
+    def _extract_entries(self, _offsets=None):
+        # 未指定偏移时按顺序提取全部条目，否则只提取给定偏移处的条目。条目与iter_entries()使用同样的解析
+        if _offsets is None:
+            entries = self._iter_entries(0, len(self.mapping), None, self.depth, False, False)
+        else:
+            entries = (self._read_plf_entry(offset, None, False) for offset in _offsets)
+        self.pipeline = ExtractionPipeline(self.options.threads)
+        if self.archive is None:
+            self.output = OutputWriter(self.options.threads, self.metrics)
+        try:
+            for entry in entries:
+                new_entry = self._extract_entry(entry)
+                self.entries.append(new_entry)
+                self.statistics[EXTRACTED_NUM] = self.statistics[EXTRACTED_NUM] + 1
+                if self.manifest is not None:
+                    # 清单在条目写入完成之后记录，文件交给I/O线程写入时推迟到其写完为止
+                    self.pipeline.write(self._record_entry, new_entry)
+        finally:
+            # 符号链接恢复之前，所有文件必须已经写入完成
+            start_time = time.perf_counter()
             try:
-                uncompressed_data = zlib.decompress(_data[_startindex : end_index + 4], zlib.MAX_WBITS | 16)
-                uncompressed_size = len(uncompressed_data)
-                if uncompressed_size == computed_size:
-                    return end_index + 4
-            except Exception as e:
-                pass
-            end_index = end_index - 1
-        return -1
+                self.pipeline.close()
+            finally:
+                if self.output is not None:
+                    self.output.close()
+            self._add_timing(TIME_FILESYSTEM, start_time)
+        start_time = time.perf_counter()
+        self._finish_verification()
+        self._add_timing(TIME_VERIFY, start_time)
+    def _record_entry(self, _fentry):
+        if _fentry.offset in self.decompress_errors:
+            return
+        if self.output is None:
+            self.manifest.add(_fentry)
+        elif _fentry.entry_type == ENTRY_INSTALLER:
+            # installer目录中的文件可能仍在I/O线程中写入，全部写完之后才记录installer.plf，中断后重新提取整个installer
+            self.output.after_all(self.manifest.add, _fentry)
+        else:
+            self.output.after(_fentry, self.manifest.add, _fentry)
+    def _extract_entry(self, _entry):
+        f_entry = _entry.header
+        data_offset = f_entry.offset + PLF_ENTRY_HEADER.size
+        if self.options.verify:
+            start_time = time.perf_counter()
+            self._verify_entry(f_entry.offset, f_entry)
+            self._add_timing(TIME_VERIFY, start_time)
+        start_time = time.perf_counter()
+        if(f_entry.entry_type == ENTRY_VOLUME_CONFIG):
+            self._extract_volume_config(data_offset, f_entry)
+        elif (f_entry.entry_type == ENTRY_INSTALLER):
+            self._extract_installer(data_offset, f_entry)
+        elif (f_entry.entry_type == ENTRY_BOOTLOADER):
+            self._extract_bootloader(data_offset, f_entry)
+        elif (f_entry.entry_type == ENTRY_MAINBOOT):
+            self._extract_kernel(data_offset, f_entry)
+        elif (f_entry.entry_type == ENTRY_FILESYSTEM):
+            self._extract_filesystem(data_offset, f_entry, _entry.content_offset)
+        phase = entry_timing_phases.get(f_entry.entry_type)
+        if phase is not None:
+            self._add_timing(phase, start_time)
+        if self.metrics is not None:
+            self.metrics.record_entry(f_entry, phase, time.perf_counter() - start_time)
+        return f_entry
+    def verify_firmware(self):
+        # 只校验每个条目的CRC32，不写入任何文件
+        if self._open_firmware():
+            if self._read_firmware_header():
+                start_time = time.perf_counter()
+                self.pipeline = ExtractionPipeline(self.options.threads)
+                try:
+                    for offset in self._entry_offsets():
+                        self._verify_entry(offset, self._read_entry_header(offset))
+                finally:
+                    self.pipeline.close()
+                self._finish_verification()
+                self._add_timing(TIME_VERIFY, start_time)
+    def _verify_entry(self, _offset, _fentry):
+        # CRC32直接在映射中已有的条目数据上计算，较大的条目交给线程池，与解压和写入并行
+        data = self._entry_data(_offset + PLF_ENTRY_HEADER.size, _fentry)
+        if self.metrics is not None:
+            self.metrics.record_phase_bytes(TIME_VERIFY, len(data))
+        if len(data) >= VERIFY_PARALLEL_SIZE:
+            result = self.pipeline.submit(self._checksum, data, _offset + PLF_ENTRY_HEADER.size)
+        else:
+            result = self._checksum(data)
+        self.checks.append((_offset, _fentry, result))
+    def _checksum(self, _data, _offset=None):
+        start_time = time.perf_counter()
+        if _offset is None:
+            crc = zlib.crc32(_data)
+        else:
+            # 较大的条目分块计算，算完一块就释放映射中的页面
+            crc = 0
+            for index in range(0, len(_data), COPY_CHUNK_SIZE):
+                chunk = _data[index:index + COPY_CHUNK_SIZE]
+                crc = zlib.crc32(chunk, crc)
+                self._release_pages(_offset + index, len(chunk))
+        return crc, time.perf_counter() - start_time
+    def _finish_verification(self):
+        mismatches = set()
+        for offset, fentry, result in self.checks:
+            if isinstance(result, concurrent.futures.Future):
+                result = result.result()
+            if result is None:
+                continue
+            crc, elapsed = result
+            expected = fentry.crc32
+            if crc != expected and fentry.uncompressed_size > 0:
+                # 压缩条目的CRC32是对gzip数据计算的，不可压缩的内容长度相同时CRC32也相同，所以CRC32不能区分两个压缩条目的内容。
+                # 压缩条目的CRC32与压缩数据不一致时，再与解压后的数据比较
+                start_time = time.perf_counter()
+                uncompressed_data = self._decompress_entry(self._entry_data(offset + PLF_ENTRY_HEADER.size, fentry))
+                if uncompressed_data is not None:
+                    crc = zlib.crc32(uncompressed_data)
+                elapsed = elapsed + time.perf_counter() - start_time
+            self.statistics[VERIFY_NUM] = self.statistics[VERIFY_NUM] + 1
+            self.statistics[VERIFY_TIME] = self.statistics[VERIFY_TIME] + elapsed
+            if crc != expected:
+                self.statistics[CRC_ERROR_NUM] = self.statistics[CRC_ERROR_NUM] + 1
+                self.logger.print_error("CRC32 mismatch in {}: entry 0x{:02x} at offset 0x{:08x} ({}), size {}, expected {:08x}, computed {:08x}".format(
+                    self.firmware, fentry.entry_type, offset, self._read_plf_entry(offset).header.path, fentry.size, expected, crc))
+                mismatches.add(offset)
+        self.checks = []
+        # 无法解压的条目没有写入；CRC32没有报告不一致时（例如未校验）也计为一个错误
+        for offset, error in sorted(self.decompress_errors.items()):
+            self.statistics[FILE_NUM] = self.statistics[FILE_NUM] - 1
+            if offset not in mismatches:
+                self.statistics[CRC_ERROR_NUM] = self.statistics[CRC_ERROR_NUM] + 1
+            self.logger.print_error("Entry at offset 0x{:08x} ({}) of {} cannot be decompressed and is not extracted: {}".format(
+                offset, self._read_plf_entry(offset).header.path, self.firmware, error))
+        self.decompress_errors.clear()
+    def _nested_firmware(self, _dir):
+        # 嵌套的PLF与外层共用映射、写入流水线、归档、CRC32校验和统计信息，条目提取到外层输出目录下的_dir目录
+        nested = FirmwareFile(self.firmware, self.outputdir + _dir, self.logger, self.options)
+        nested.rootdir = self.rootdir
+        nested.depth = self.depth + 1
+        nested.mapping = self.mapping
+        nested.view = self.view
+        nested.pipeline = self.pipeline
+        nested.output = self.output
+        nested.archive = self.archive
+        nested.store = self.store
+        nested.statistics = self.statistics
+        nested.checks = self.checks
+        nested.decompress_errors = self.decompress_errors
+        nested.metrics = self.metrics
+        if nested.archive is not None:
+            # 与输出目录一样，没有条目的installer目录也写入归档
+            self.pipeline.write(nested.archive.add_directory, nested._archive_name(nested.outputdir), OUTPUT_DIR_PERMISSIONS)
+        elif not os.path.exists(nested.outputdir):
+            os.makedirs(nested.outputdir)
+            self.logger.print_log("Creates directory {}", nested.outputdir)
+        return nested
+    def _extract_volume_config(self, _offset, _fentry):
+        self.properties[NB_ENTRIES] = VOLUME_CONFIG_HEADER.unpack_from(self.mapping, _offset)[-1]
+        if self.archive is None:
+            if not os.path.exists(self.outputdir):
+                os.makedirs(self.outputdir)
+                self.logger.print_log("Creates directory {}", self.outputdir)
+            else:
+                self.logger.print_log("Directory {} exists", self.outputdir)
+        lines = ["[volume_config]\n"]
+        # self.logger.print_info("{} partition(s) found in {}", self.properties[NB_ENTRIES], self.firmware)
+        offset = _offset + VOLUME_CONFIG_HEADER.size
+        for i in range(0, self.properties[NB_ENTRIES]):
+            p_entry = Partition()
+            p_entry.partition_properties.update(zip(VOLUME_PARTITION_FIELDS, VOLUME_PARTITION.unpack_from(self.mapping, offset)))
+            p_entry.partition_properties[P_VOLUME_NAME] = p_entry.partition_properties[P_VOLUME_NAME].decode("utf-8")
+            p_entry.partition_properties[P_VOLUME_MOUNT_NAME] = p_entry.partition_properties[P_VOLUME_MOUNT_NAME].decode("utf-8")
+            offset = offset + VOLUME_PARTITION.size
+            self.partitions.append(p_entry)
+            p_entry_string = p_entry._object_to_string(p_entry)
+            # self.logger.print_log(p_entry_string)
+            # self.logger.print_info(p_entry_string)
+            p_entry_string = p_entry_string + "\n"
+            lines.append(p_entry_string)
+        self._output_file(volume_config_file, "".join(lines).encode("utf-8"))
+    def _output_file(self, _file_name, _data, _offset=None):
+        # 内核、bootloader等输出文件直接写入输出目录，或者按顺序交给写入线程写入归档
+        if self.archive is not None:
+            self.pipeline.write(self._write_archive_file, self._archive_name(self.outputdir + _file_name), OUTPUT_FILE_PERMISSIONS, _data, _offset)
+        else:
+            self._count(OP_OPEN)
+            with open(self.outputdir + _file_name, 'wb') as f:
+                self._write_data(f, _data, _offset)
+                f.close()
+        self.logger.print_log("File {} creates", self.outputdir + _file_name)
+    def _write_archive_file(self, _name, _permissions, _data, _offset=None):
+        release = None
+        if _offset is not None:
+            release = lambda index, length: self._release_pages(_offset + index, length)
+        self.archive.add_file(_name, _permissions, _data, release)
+    def _extract_installer(self, _offset, _fentry):
+        data = self._entry_data(_offset, _fentry)
+        self._output_file(installer_file, data, _offset)
+        self.logger.print_info("Installer found. File {}", self.outputdir + installer_file)
+        # installer.plf本身也是PLF，其中的条目按同样的方式提取到installer目录
+        if self._read_plf_header(_offset) is None:
+            self.logger.print_log("Installer {} is not a parrot firmware!", self.outputdir + installer_file)
+            return
+        if self.depth + 1 >= PLF_MAX_DEPTH:
+            self.logger.print_log("Installer {} is nested too deeply!", self.outputdir + installer_file)
+            return
+        nested = self._nested_firmware(installer_dir)
+        for entry in nested._iter_entries(_offset, _offset + _fentry.size, None, nested.depth, False, False):
+            nested.entries.append(nested._extract_entry(entry))
+        self.nested.append(nested)
+        self.logger.print_info("Installer extracted. Directory {}", nested.outputdir)
+    def _extract_bootloader(self, _offset, _fentry):
+        data = self._entry_data(_offset, _fentry)
+        self._output_file(bootloader_file, data, _offset)
+        self.logger.print_info("Bootloader found. File {}", self.outputdir + bootloader_file)
+    def _extract_kernel(self, _offset, _fentry):
+        data = self._entry_data(_offset, _fentry)
+        self._output_file(kernel_plf_file, data, _offset)
+        self.logger.print_info("Kernel found. File {}", self.outputdir + kernel_plf_file)
+        zimage_entry, bootparam_entry = self._kernel_entries(_offset, _fentry)
+        # 找到zImage
+        if zimage_entry is None:
+            self.logger.print_log("Kernel zImage is not found in {}", self.outputdir + kernel_plf_file)
+        else:
+            zimage_offset = zimage_entry.offset + PLF_ENTRY_HEADER.size
+            zimage_data = self._entry_data(zimage_offset, zimage_entry)
+            self._output_file(kernel_zImage_file, zimage_data, zimage_offset)
+            self.logger.print_info("Kernel zImage file creates. File {}", self.outputdir + kernel_zImage_file)
+            self._extract_compressed_kernel(zimage_offset, zimage_data)
+        # 找到bootparam
+        if bootparam_entry is None:
+            self.logger.print_log("Bootparam is not found in {}", self.outputdir + kernel_plf_file)
+        else:
+            bootparam_offset = bootparam_entry.offset + PLF_ENTRY_HEADER.size
+            self._output_file(bootparam_file, self._entry_data(bootparam_offset, bootparam_entry))
+            self.logger.print_info("Bootparam file creates. File {}", self.outputdir + bootparam_file)
+    def _extract_compressed_kernel(self, _offset, _data):
+        # 找到gzip或者lzma压缩的内核
+        gzip_start_index = self.mapping.find(b'\x1f\x8b\x08', _offset, _offset + len(_data))
+        lzma_start_index = self.mapping.find(b'\x5d\x00\x00', _offset, _offset + len(_data))
+        flag = False
+        if gzip_start_index != -1 and flag is False:
+            gzip_start_index = gzip_start_index - _offset
+            gzip_end_index = self._find_gzip_end_pos(_data, gzip_start_index)
+            if gzip_end_index != -1:
+                flag = True
+                gzip_data = _data[gzip_start_index:gzip_end_index]
+                self._output_file(kernel_gzip_file, gzip_data)
+                self.logger.print_info("Kernel gzip file creates. File {}", self.outputdir + kernel_gzip_file)
+        if lzma_start_index != -1 and flag is False:
+            lzma_start_index = lzma_start_index - _offset
+            lzma_end_index = self._find_lzma_end_pos(_data, lzma_start_index)
+            if lzma_end_index != -1:
+                lzma_data = _data[lzma_start_index:lzma_end_index]
+                self._output_file(kernel_lzma_file, lzma_data)
+                self.logger.print_info("Kernel lzma file creates. File {}", self.outputdir + kernel_lzma_file)
+    def _find_gzip_end_pos(self, _data, _startindex):
+        # gzip成员的结尾处是ISIZE字段，即解压后数据长度的低32位
+        decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+        stream_end, uncompressed_size = self._find_stream_end_pos(decompressor, _data, _startindex)
+        if stream_end == -1 or stream_end - 4 < _startindex:
+            return -1
+        computed_size = struct.unpack('I', _data[stream_end - 4 : stream_end])[0]
+        if uncompressed_size & 0xFFFFFFFF != computed_size:
+            return -1
+        return stream_end
     def _find_lzma_end_pos(self, _data, _startindex):
-        end_index = len(_data) - 4
-        while end_index >= 0:
-            computed_size = struct.unpack('I', _data[end_index : end_index + 4])[0]
-            try:
-                uncompressed_data = lzma.decompress(_data[_startindex : end_index])
-                uncompressed_size = len(uncompressed_data)
-                if uncompressed_size == computed_size:
-                    return end_index + 4
-            except Exception as e:
-                pass
-            end_index = end_index - 1
-        return -1
-    def _extract_filesystem(self, _fhandle, _fentry):
-        if not os.path.exists(self.outputdir + filesystem_dir):
-            os.makedirs(self.outputdir + filesystem_dir)
-            self.logger.print_log("Creates filesystem directory {}".format(self.outputdir + filesystem_dir))
-        global FILE_NUM, DIR_NUM, SYMLINK_NUM, UNKNOWN_NUM
+        # 内核在lzma数据流之后追加了4字节的解压后数据长度
+        decompressor = lzma.LZMADecompressor()
+        stream_end, uncompressed_size = self._find_stream_end_pos(decompressor, _data, _startindex)
+        if stream_end == -1 or stream_end + 4 > len(_data):
+            return -1
+        computed_size = struct.unpack('I', _data[stream_end : stream_end + 4])[0]
+        if uncompressed_size != computed_size:
+            return -1
+        return stream_end + 4
+    def _find_stream_end_pos(self, _decompressor, _data, _startindex):
+        # 从压缩数据起始处向后分块增量解压，只统计解压后的长度而不保留数据，
+        # 解压器到达数据流结尾时，未被使用的数据长度即可确定压缩数据的结束位置。
+        view = memoryview(_data)
+        uncompressed_size = 0
+        index = _startindex
+        try:
+            while index < len(view) and not _decompressor.eof:
+                chunk = view[index : index + STREAM_CHUNK_SIZE]
+                index = index + len(chunk)
+                uncompressed_size = uncompressed_size + len(_decompressor.decompress(chunk))
+        except (zlib.error, lzma.LZMAError):
+            return -1, 0
+        if not _decompressor.eof:
+            return -1, 0
+        return index - len(_decompressor.unused_data), uncompressed_size
+    def _extract_filesystem(self, _offset, _fentry, _content_offset):
+        if self.archive is None and self.output.make_dirs(self.outputdir + filesystem_dir):
+            self.logger.print_log("Creates filesystem directory {}", self.outputdir + filesystem_dir)
         is_compressed = False
-        if _fentry.entry_properties[P_ENTRY_UNCOMPRESSED_SIZE] > 0:
+        if _fentry.uncompressed_size > 0:
             is_compressed = True
+        entry_end = _offset + _fentry.size
+        if self.store is not None:
+            _fentry.store_key = self.store.entry_key(self.view[_offset:entry_end])
+        # 读取线程只负责解析条目，创建目录和文件的操作按条目顺序交给写入线程
+        # 未压缩条目的文件名、类型、权限和符号链接目标已经在解析条目时读取，_content_offset是文件内容在映射中的偏移
         if not is_compressed:
-            # 文件名或者目录名
-            name = self._read_string(_fhandle)
-            # 文件类型和权限
-            flags = self._read_u32_bytes(_fhandle)
-            permissions, file_type = self._get_file_type(flags)
-            _fentry.entry_properties[P_TYPE] = file_type
-            self._read_u32_bytes(_fhandle)
-            self._read_u32_bytes(_fhandle)
+            offset = _content_offset
+            name = _fentry.path
+            permissions = _fentry.permissions
+            file_type = _fentry.fs_type
             # 文件内容
             if file_type == FS_DIR:
-                _fentry.entry_properties[P_DIRNAME] = name
-                _fentry.entry_properties[P_DIRPER] = oct(permissions)
-                DIR_NUM = DIR_NUM + 1
+                self.statistics[DIR_NUM] = self.statistics[DIR_NUM] + 1
                 dir_full_name = self.outputdir + filesystem_dir + '/' + name
-                if not os.path.exists(dir_full_name):
-                    os.makedirs(dir_full_name, mode=permissions)
-                    self.logger.print_log("Directory {} creates. Permissions is {}".format(dir_full_name, oct(permissions)))
-                else:
-                    os.chmod(dir_full_name, permissions)
-                    self.logger.print_log("Directory {} exists. Permissions is {}".format(dir_full_name, oct(permissions)))
+                self.pipeline.write(self._write_directory, dir_full_name, permissions)
             elif file_type == FS_FILE:
-                _fentry.entry_properties[P_FILENAME] = name
-                _fentry.entry_properties[P_FILEPER] = oct(permissions)
-                FILE_NUM = FILE_NUM + 1
-                file_data = _fhandle.read(_fentry.entry_properties[P_ENTRY_SIZE] - len(name) - 1 - 12)
-                _fentry.entry_properties[P_FILEDATA] = file_data
-                file_full_name = self.outputdir + filesystem_dir + '/' + name
-                dir_name = os.path.dirname(file_full_name)
-                file_name = os.path.basename(file_full_name)
-                if not os.path.exists(dir_name):
-                    os.makedirs(dir_name)
-                with open(file_full_name, 'wb') as f:
-                    f.write(file_data)
-                    f.close()
-                    self.logger.print_log("File {} creates. Permissions is {}".format(file_full_name, oct(permissions)))
-                os.chmod(file_full_name, permissions)
+                self.statistics[FILE_NUM] = self.statistics[FILE_NUM] + 1
+                if self.store is not None and self.store.contains(_fentry):
+                    self.pipeline.write(self._link_stored_file, _fentry)
+                else:
+                    file_data = self.view[offset:entry_end]
+                    file_full_name = self.outputdir + filesystem_dir + '/' + name
+                    self.pipeline.write(self._write_file, file_full_name, permissions, file_data, "File", offset, _fentry)
             elif file_type == FS_SYMLINK:
                 # 在文件创建工作完成之后，再进行恢复符号链接工作，这里先不进行。
-                _fentry.entry_properties[P_FILENAME] = name
-                SYMLINK_NUM = SYMLINK_NUM + 1
-                symbol_link_data = self._read_string(_fhandle)
-                _fentry.entry_properties[P_SYMLINK] = symbol_link_data
-                self.logger.print_log("This is a symbol link. {} --> {}".format(name, symbol_link_data))
-            elif file_type == 0x02:
-                UNKNOWN_NUM = UNKNOWN_NUM + 1
+                self.statistics[SYMLINK_NUM] = self.statistics[SYMLINK_NUM] + 1
+                self.logger.print_log("This is a symbol link. {} --> {}", name, _fentry.target)
+            elif file_type == FS_DEVICE:
+                self.statistics[UNKNOWN_NUM] = self.statistics[UNKNOWN_NUM] + 1
                 # 特殊文件dev/console: b'\xb6\x21' AR_Drone_v1.5.1.plf
-                data = _fhandle.read(_fentry.entry_properties[P_ENTRY_SIZE] - len(name) - 1 - 12)
-                self.logger.print_log("Unknown type file! File name is {}. File data is {}".format(name, data))
+                data = self.mapping[offset:entry_end]
+                self.logger.print_log("Unknown type file! File name is {}. File data is {}", name, data)
+                if self.archive is not None:
+                    self.pipeline.write(self.archive.add_device, self._archive_name(self.outputdir + filesystem_dir + '/' + name), permissions, data)
         else:
-            FILE_NUM = FILE_NUM + 1
-            compressed_data = _fhandle.read(_fentry.entry_properties[P_ENTRY_SIZE])
-            name, flags, data = self._uncompress_file(_fentry, compressed_data)
-            permissions, file_type = self._get_file_type(flags)
-            _fentry.entry_properties[P_TYPE] = file_type
-            _fentry.entry_properties[P_FILENAME] = name
-            _fentry.entry_properties[P_FILEPER] = oct(permissions)
-            _fentry.entry_properties[P_FILEDATA] = data
-            file_full_name = self.outputdir + filesystem_dir + '/' + name
-            dir_name = os.path.dirname(file_full_name)
-            file_name = os.path.basename(file_full_name)
-            if not os.path.exists(dir_name):
-                os.makedirs(dir_name)
-            with open(file_full_name, 'wb') as f:
-                f.write(data)
-                f.close()
-                self.logger.print_log("Uncompressed File {} creates. Permissions is {}".format(file_full_name, oct(permissions)))
-            os.chmod(file_full_name, permissions)
-    def _get_file_type(self, _flags):
-        permissions = int(oct(int.from_bytes(_flags, byteorder='little') & 0x0FFF), 8)
-        filetype = (int.from_bytes(_flags, byteorder='little') & 0xF000) >> 12
-        return permissions, filetype
+            self.statistics[FILE_NUM] = self.statistics[FILE_NUM] + 1
+            compressed_data = self.view[_offset:entry_end]
+            if self.store is not None and self.store.contains(_fentry):
+                # 存储中已有相同的条目，只解压开头的文件头取得文件名，不解压也不写入文件内容
+                self._read_filesystem_header(_fentry)
+                self.pipeline.write(self._link_stored_file, _fentry)
+                return
+            # 较大的压缩条目交给解压线程池，较小的直接在读取线程中解压，避免线程调度的开销
+            if len(compressed_data) >= PIPELINE_MIN_SIZE:
+                result = self.pipeline.submit(self._uncompress_entry, _fentry, compressed_data)
+            else:
+                result = self._uncompress_entry(_fentry, compressed_data)
+            self.pipeline.write(self._write_uncompressed_file, _fentry, result)
+    def _write_directory(self, _dir_full_name, _permissions):
+        if self.archive is not None:
+            self.archive.add_directory(self._archive_name(_dir_full_name), _permissions)
+            self.logger.print_log("Directory {} adds to archive. Permissions is {:#o}", _dir_full_name, _permissions)
+            return
+        if self.output.make_directory(_dir_full_name, _permissions):
+            self.logger.print_log("Directory {} creates. Permissions is {:#o}", _dir_full_name, _permissions)
+        else:
+            self.logger.print_log("Directory {} exists. Permissions is {:#o}", _dir_full_name, _permissions)
+    def _write_file(self, _file_full_name, _permissions, _data, _kind, _offset=None, _fentry=None):
+        if self.archive is not None:
+            self._write_archive_file(self._archive_name(_file_full_name), _permissions, _data, _offset)
+            self.logger.print_log("{} {} adds to archive. Permissions is {:#o}", _kind, _file_full_name, _permissions)
+            return
+        # 写入线程只按顺序创建所在目录，文件的打开、写入和关闭交给I/O线程
+        self.output.make_dirs(os.path.dirname(_file_full_name))
+        self.output.submit(_fentry, self._write_file_data, _file_full_name, _permissions, _data, _kind, _offset, _fentry)
+    def _write_file_data(self, _file_full_name, _permissions, _data, _kind, _offset, _fentry):
+        if self.store is not None and _fentry is not None:
+            self._store_file(_file_full_name, _permissions, _data, _kind, _offset, _fentry)
+            return
+        with self.output.open_file(_file_full_name, _permissions) as f:
+            self._write_data(f, _data, _offset)
+            f.close()
+            self.logger.print_log("{} {} creates. Permissions is {:#o}", _kind, _file_full_name, _permissions)
+    def _store_file(self, _file_full_name, _permissions, _data, _kind, _offset, _fentry):
+        # 先写入存储的临时文件并同时计算内容哈希，再以哈希和权限为名保存，文件系统目录中只建立链接
+        fd, temp_file_name = self.store.temp_file()
+        hasher = hashlib.sha256()
+        with os.fdopen(fd, 'wb') as f:
+            self._write_data(f, _data, _offset, hasher)
+            f.close()
+        os.chmod(temp_file_name, _permissions)
+        blob, is_new = self.store.add(temp_file_name, hasher.hexdigest(), _permissions, _fentry)
+        self._count(OP_OPEN)
+        self._count(OP_CHMOD)
+        self._count(OP_LINK, 2)
+        # 多个I/O线程同时保存文件，计数在输出层的锁内累加
+        with self.output.lock:
+            if is_new:
+                self.statistics[STORE_NEW_NUM] = self.statistics[STORE_NEW_NUM] + 1
+            else:
+                self.statistics[STORE_DEDUP_NUM] = self.statistics[STORE_DEDUP_NUM] + 1
+        self.store.link(blob, _file_full_name)
+        self.logger.print_log("{} {} {} store. Permissions is {:#o}", _kind, _file_full_name, "adds to" if is_new else "links to", _permissions)
+    def _link_stored_file(self, _fentry):
+        file_full_name = self.outputdir + filesystem_dir + '/' + _fentry.path
+        self.output.make_dirs(os.path.dirname(file_full_name))
+        self._count(OP_LINK)
+        self.store.link_entry(_fentry, file_full_name)
+        self.statistics[STORE_HIT_NUM] = self.statistics[STORE_HIT_NUM] + 1
+        self.logger.print_log("File {} links to store. Permissions is {:#o}", file_full_name, _fentry.permissions)
+    def _write_data(self, _file, _data, _offset=None, _hasher=None):
+        # 较大的数据分块写入。数据来自映射时（_offset为其在映射中的偏移），
+        # 每写完一块就让内核回收这部分页面，峰值内存不随条目大小增长。
+        if len(_data) <= COPY_CHUNK_SIZE:
+            _file.write(_data)
+            if _hasher is not None:
+                _hasher.update(_data)
+            return
+        for index in range(0, len(_data), COPY_CHUNK_SIZE):
+            chunk = _data[index:index + COPY_CHUNK_SIZE]
+            _file.write(chunk)
+            if _hasher is not None:
+                _hasher.update(chunk)
+            if _offset is not None:
+                self._release_pages(_offset + index, len(chunk))
+    def _uncompress_entry(self, _fentry, _fdata):
+        # 损坏的压缩条目不中断提取，在校验结束时与CRC32不一致的条目一起报告
+        try:
+            return self._uncompress_file(_fentry, _fdata)
+        except zlib.error as e:
+            self.decompress_errors[_fentry.offset] = str(e)
+            return None
+    def _write_uncompressed_file(self, _fentry, _result):
+        if _result is None:
+            return
+        name, flags, data = _result
+        permissions, file_type = self._get_file_type(flags)
+        _fentry.fs_type = file_type
+        _fentry.path = name
+        _fentry.permissions = permissions
+        self._write_file(self.outputdir + filesystem_dir + '/' + name, permissions, data, "Uncompressed File", None, _fentry)
     def _recover_symlink(self):
+        for nested in self.nested:
+            nested._recover_symlink()
         for entry in self.entries:
-            if entry.entry_properties.get(P_TYPE) == FS_SYMLINK:
-                file_full_name = self.outputdir + filesystem_dir + '/' + entry.entry_properties[P_FILENAME]
-                symbol_full_name = entry.entry_properties[P_SYMLINK]
+            if entry.fs_type == FS_SYMLINK and entry.target:
+                file_full_name = self.outputdir + filesystem_dir + '/' + entry.path
+                symbol_full_name = entry.target
+                if self.archive is not None:
+                    self.archive.add_symlink(self._archive_name(file_full_name), symbol_full_name)
+                    self.logger.print_log("Symbol link adds to archive. {} --> {}", file_full_name, symbol_full_name)
+                    continue
+                self._count(OP_STAT)
+                if os.path.islink(file_full_name) and os.readlink(file_full_name) == symbol_full_name:
+                    self.logger.print_log("Symbol link exists. {} --> {}", file_full_name, symbol_full_name)
+                    continue
+                # 重新提取时替换已存在的文件或者指向其他位置的符号链接
+                if os.path.lexists(file_full_name):
+                    self._count(OP_UNLINK)
+                    os.unlink(file_full_name)
+                # 只提取部分路径时，符号链接所在的目录条目可能没有被提取。
+                # 输出层关闭后仍保留已创建目录的记录，可以继续用来创建目录
+                self.output.make_dirs(os.path.dirname(file_full_name))
+                self._count(OP_SYMLINK)
                 os.symlink(symbol_full_name, file_full_name)
-                self.logger.print_log("Symbol link creats. {} --> {}".format(file_full_name, symbol_full_name))
-    def _uncompress_file(self, _fentry, _fdata):
-        uncompressed_data = zlib.decompress(_fdata, zlib.MAX_WBITS | 16)
-        if len(uncompressed_data) == _fentry.entry_properties[P_ENTRY_UNCOMPRESSED_SIZE]:
-            self.logger.print_log("Uncompress file is successful!")
-        else:
-            self.logger.print_log("Uncompress file fails!")
-        data = uncompressed_data.split(b'\x00', 1)
-        filename = data[0].decode('utf-8')
-        filedata = data[1]
-        flags = filedata[0:4]
-        return filename, flags, filedata[12:]
+                self.logger.print_log("Symbol link creats. {} --> {}", file_full_name, symbol_full_name)
     def _statistics_file_info(self):
-        self.logger.print_info("Filesystem: Creates {} file(s), {} directory(s) and {} symbol link(s). Meanwhile, {} file(s) belongs to unknown type.".format(FILE_NUM, DIR_NUM, SYMLINK_NUM, UNKNOWN_NUM))
+        self.logger.print_info("Filesystem: Creates {} file(s), {} directory(s) and {} symbol link(s). Meanwhile, {} file(s) belongs to unknown type.".format(
+            self.statistics[FILE_NUM], self.statistics[DIR_NUM], self.statistics[SYMLINK_NUM], self.statistics[UNKNOWN_NUM]))
+        if self.options.verify:
+            self._statistics_verify_info()
+        if self.store is not None:
+            self.logger.print_info("Store: {} file(s) linked without decompression, {} new file(s) stored, {} file(s) deduplicated by content.".format(
+                self.statistics[STORE_HIT_NUM], self.statistics[STORE_NEW_NUM], self.statistics[STORE_DEDUP_NUM]))
+    def _statistics_verify_info(self):
+        self.logger.print_info("CRC32: {} entry(s) checked in {:.3f} s, {} mismatch(es).".format(
+            self.statistics[VERIFY_NUM], self.statistics[VERIFY_TIME], self.statistics[CRC_ERROR_NUM]))
 class FirmwareEntry(object):
-    def __init__(self):
-        self.entry_properties = {}
+    # 条目的元数据。使用__slots__代替每个条目一个字典，条目内容写出后立即丢弃，不在这里保留。
+    __slots__ = ("offset", "entry_type", "size", "crc32", "load_address", "uncompressed_size", "fs_type", "permissions", "path", "target",
+                 "store_key")
+    def __init__(self, _offset, _entry_type, _size, _crc32, _load_address, _uncompressed_size):
+        self.offset = _offset
+        self.entry_type = _entry_type
+        self.size = _size
+        self.crc32 = _crc32
+        self.load_address = _load_address
+        self.uncompressed_size = _uncompressed_size
+        # 文件系统条目的类型、权限、路径和符号链接目标
+        self.fs_type = 0
+        self.permissions = 0
+        self.path = ""
+        self.target = ""
+        # 使用内容存储时条目原始数据的sha256
+        self.store_key = None
+    def _object_to_string(self):
+        if self.entry_type == ENTRY_FILESYSTEM:
+            mode = FS_TYPE_CHARS.get(self.fs_type, '?') + "{:04o}".format(self.permissions)
+        else:
+            mode = "-----"
+        line = "0x{:02x} {} {:>10} {:>10} {:08x} 0x{:08x}  {}".format(
+            self.entry_type, mode, self.size, self.uncompressed_size, self.crc32, self.offset, self.path)
+        if self.target:
+            line = line + " -> " + self.target
+        return line
+class PlfEntry(object):
+    # iter_entries()给出的条目。元数据在解析时读取，内容在读取时才从映射中切出或者解压，可以分块读取。
+    # header是条目头的FirmwareEntry，包含偏移、CRC32和大小等原始字段
+    __slots__ = ("reader", "header", "kind", "path", "permissions", "target", "container", "content_offset", "size")
+    def __init__(self, _reader, _header, _content_offset, _container=None):
+        self.reader = _reader
+        self.header = _header
+        self.path = _header.path
+        self.permissions = _header.permissions
+        self.target = _header.target
+        # 条目所在的嵌套PLF，如"installer"，最外层的条目为None
+        self.container = _container
+        # 内容在映射中的偏移，压缩的文件系统条目为-1
+        self.content_offset = _content_offset
+        entry_end = _header.offset + PLF_ENTRY_HEADER.size + _header.size
+        if _header.entry_type == ENTRY_FILESYSTEM:
+            self.kind = filesystem_kinds.get(_header.fs_type, KIND_UNKNOWN)
+            if self.kind == KIND_DIRECTORY or self.kind == KIND_SYMLINK:
+                self.size = 0
+            elif _content_offset == -1:
+                self.size = _header.uncompressed_size - len(_header.path.encode("utf-8")) - 1 - FS_ENTRY_HEADER.size
+            else:
+                self.size = entry_end - _content_offset
+        else:
+            self.kind = entry_kinds.get(_header.entry_type, KIND_UNKNOWN)
+            self.size = _header.size
+    def chunks(self, _chunk_size=COPY_CHUNK_SIZE):
+        # 依次给出不超过_chunk_size的内容块，压缩条目边读边解压。目录和符号链接没有内容
+        if self.size <= 0:
+            return
+        if self.content_offset == -1:
+            yield from self.reader._iter_uncompressed(self.header, _chunk_size)
+            return
+        end = self.content_offset + self.size
+        for index in range(self.content_offset, end, _chunk_size):
+            yield self.reader.mapping[index:min(index + _chunk_size, end)]
+    def read(self):
+        return b"".join(self.chunks())
+    def output_path(self):
+        # 条目提取后在输出目录中的相对路径
+        prefix = "" if self.container is None else self.container + "/"
+        if self.header.entry_type == ENTRY_FILESYSTEM:
+            return prefix + filesystem_dir[1:] + "/" + self.path
+        if self.path:
+            return prefix + self.path
+        return prefix + "entry_0x{:02x}".format(self.header.entry_type)
 class Partition(object):
     def __init__(self):
         self.partition_properties = {}
@@ -429,40 +2012,592 @@ class Partition(object):
             p_entry.partition_properties[P_VOLUME_SIZE],
             p_entry.partition_properties[P_VOLUME_ACTION]
         )
-def do_extract(input_file, output_dir, is_log, is_info):
+def iter_entries(source, nested=True, logger=None):
+    # 不写入任何文件，依次给出固件中的条目。source可以是固件文件路径、文件对象或者bytes。
+    # 条目内容只能在迭代期间读取，迭代结束后映射即被关闭
+    reader = PlfReader(source, logger)
+    try:
+        yield from reader.iter_entries(nested)
+    finally:
+        reader.close()
+def do_extract(input_file, output_dir, is_log, is_info, options=None):
     logger = Logger()
     logger.log = is_log
     logger.info = is_info
-    logger.print_log("Processing file: {}".format(input_file))
+    if options is not None and options.stdout:
+        logger.output = sys.stderr
+    logger.print_log("Processing file: {}", input_file)
     # 创建固件文件对象，并解析固件头和条目。
-    firmware = FirmwareFile(input_file, output_dir, logger)
-    firmware.parse_firmware()
+    firmware = FirmwareFile(input_file, output_dir, logger, options)
+    start_time = time.perf_counter()
+    if firmware.options.verify_only:
+        firmware.verify_firmware()
+    else:
+        firmware.parse_firmware()
+    firmware.close()
+    if firmware.metrics is not None:
+        firmware.statistics[METRICS] = firmware.metrics.report(firmware, time.perf_counter() - start_time)
+    return firmware.statistics
+
+def do_list(input_file, is_log):
+    logger = Logger()
+    logger.log = is_log
+    firmware = FirmwareFile(input_file, None, logger)
+    index = firmware.load_index()
+    firmware.close()
+    if index is None:
+        return False
+    print("[*] {}: {} entry(s)".format(input_file, len(index)))
+    print("type mode        size uncompressed    crc32     offset  path")
+    for record in index:
+        print(record._object_to_string())
+    return True
+
+def do_extract_paths(input_file, output_dir, paths, is_log, is_info, options=None):
+    logger = Logger()
+    logger.log = is_log
+    logger.info = is_info
+    if options is not None and options.stdout:
+        logger.output = sys.stderr
+    logger.print_log("Processing file: {}", input_file)
+    firmware = FirmwareFile(input_file, output_dir, logger, options)
+    found = firmware.extract_paths(paths)
+    firmware.close()
+    return found
+
+def _entry_changes(old_entry, new_entry):
+    # 比较两个条目的元数据，返回变化的描述，不解压条目内容。
+    # 压缩条目的CRC32不能区分其内容（见FirmwareFile._finish_verification()），元数据相同时再比较两个条目的原始数据
+    changes = []
+    if old_entry.kind != new_entry.kind:
+        changes.append("type {} -> {}".format(old_entry.kind, new_entry.kind))
+    if old_entry.header.crc32 != new_entry.header.crc32:
+        changes.append("crc32 {:08x} -> {:08x}".format(old_entry.header.crc32, new_entry.header.crc32))
+    if old_entry.header.size != new_entry.header.size:
+        changes.append("size {} -> {}".format(old_entry.header.size, new_entry.header.size))
+    if old_entry.header.uncompressed_size != new_entry.header.uncompressed_size:
+        changes.append("uncompressed {} -> {}".format(old_entry.header.uncompressed_size, new_entry.header.uncompressed_size))
+    if old_entry.permissions != new_entry.permissions:
+        changes.append("mode {:04o} -> {:04o}".format(old_entry.permissions, new_entry.permissions))
+    if old_entry.target != new_entry.target:
+        changes.append("target {} -> {}".format(old_entry.target, new_entry.target))
+    if not changes and old_entry.header.uncompressed_size > 0 and _raw_entry_data(old_entry) != _raw_entry_data(new_entry):
+        changes.append("compressed data differs")
+    return changes
+
+def _raw_entry_data(entry):
+    offset = entry.header.offset + PLF_ENTRY_HEADER.size
+    return entry.reader.mapping[offset:offset + entry.header.size]
+
+def _describe_entry(entry):
+    if entry.kind == KIND_SYMLINK:
+        return "{} -> {}".format(entry.kind, entry.target)
+    if entry.kind == KIND_DIRECTORY:
+        return "{} {:04o}".format(entry.kind, entry.permissions)
+    return "{} {:04o} {} bytes".format(entry.kind, entry.permissions, entry.size)
+
+def _content_diff(old_entry, new_entry, name):
+    # 只对元数据不同的条目解压并比较内容：文本给出unified diff，二进制给出第一个不同的位置
+    if old_entry.kind in (KIND_DIRECTORY, KIND_SYMLINK) or new_entry.kind in (KIND_DIRECTORY, KIND_SYMLINK):
+        return []
+    old_data = old_entry.read()
+    new_data = new_entry.read()
+    if old_data == new_data:
+        return ["    content is identical"]
+    # bootparam等文本以'\x00'结尾
+    old_text = old_data.rstrip(b'\x00')
+    new_text = new_data.rstrip(b'\x00')
+    if b'\x00' not in old_text and b'\x00' not in new_text:
+        try:
+            old_lines = old_text.decode("utf-8").splitlines(True)
+            new_lines = new_text.decode("utf-8").splitlines(True)
+            return ["    " + line.rstrip("\n") for line in difflib.unified_diff(old_lines, new_lines, "a/" + name, "b/" + name)]
+        except UnicodeDecodeError:
+            pass
+    index = 0
+    length = min(len(old_data), len(new_data))
+    while index < length and old_data[index:index + COPY_CHUNK_SIZE] == new_data[index:index + COPY_CHUNK_SIZE]:
+        index = index + COPY_CHUNK_SIZE
+    while index < length and old_data[index] == new_data[index]:
+        index = index + 1
+    return ["    binary content differs at offset 0x{:08x} ({} -> {} bytes)".format(index, len(old_data), len(new_data))]
+
+def do_diff(old_file, new_file, is_log, show_content=False):
+    # 只解析两个固件的条目头，按路径比较元数据。只有show_content为True时，才解压并比较元数据不同的条目的内容
+    logger = Logger()
+    logger.log = is_log
+    old_firmware = PlfReader(old_file, logger)
+    new_firmware = PlfReader(new_file, logger)
+    try:
+        old_entries = old_firmware.diff_entries()
+        new_entries = new_firmware.diff_entries()
+        if old_entries is None or new_entries is None:
+            logger.print_error("Cannot compare {} with {}: not a parrot firmware".format(old_file, new_file))
+            return 2
+        lines = []
+        added = 0
+        removed = 0
+        modified = 0
+        for name in sorted(set(old_entries) | set(new_entries)):
+            old_entry = old_entries.get(name)
+            new_entry = new_entries.get(name)
+            if old_entry is None:
+                added = added + 1
+                lines.append("A  {}  ({})".format(name, _describe_entry(new_entry)))
+            elif new_entry is None:
+                removed = removed + 1
+                lines.append("D  {}  ({})".format(name, _describe_entry(old_entry)))
+            else:
+                changes = _entry_changes(old_entry, new_entry)
+                if changes:
+                    modified = modified + 1
+                    lines.append("M  {}  {}".format(name, ", ".join(changes)))
+                    if show_content:
+                        lines.extend(_content_diff(old_entry, new_entry, name))
+        unchanged = len(set(old_entries) & set(new_entries)) - modified
+        print("[*] {} -> {}: {} added, {} removed, {} modified, {} unchanged".format(old_file, new_file, added, removed, modified, unchanged))
+        for line in lines:
+            print(line)
+    finally:
+        old_firmware.close()
+        new_firmware.close()
+    return 1 if added + removed + modified > 0 else 0
+
+def _search_units(input_file, jobs, logger):
+    # 只解析条目头，把固件的条目按大小分成若干组交给搜索进程，installer.plf中的条目单独分组
+    reader = PlfReader(input_file, logger)
+    units = []
+    try:
+        if not reader._open_firmware() or not reader._read_firmware_header():
+            return units
+        entries = []
+        total_size = 0
+        for entry in reader._iter_entries(0, len(reader.mapping), None, 0, True, False):
+            entries.append((entry.header.offset, entry.container, entry.header.size))
+            total_size = total_size + entry.header.size
+    finally:
+        reader.close()
+    unit_size = max(SEARCH_UNIT_SIZE, total_size // (jobs * 4))
+    unit = []
+    size = 0
+    for offset, container, entry_size in entries:
+        unit.append((offset, container))
+        size = size + entry_size
+        if size >= unit_size:
+            units.append((input_file, unit))
+            unit = []
+            size = 0
+    if unit:
+        units.append((input_file, unit))
+    return units
+
+def _search_contents(reader, entry):
+    # 条目中需要搜索的内容：(输出路径, 内容块)。main_boot.plf分为zImage、bootparam和解压后的内核，
+    # 能作为PLF解析的installer.plf由其中的条目分别搜索，目录和符号链接没有内容
+    if entry.kind == KIND_MAINBOOT:
+        for kernel_entry in reader._kernel_plf_entries(entry):
+            yield kernel_entry.output_path(), kernel_entry.chunks()
+            if kernel_entry.kind == KIND_ZIMAGE:
+                prefix = "" if entry.container is None else entry.container + "/"
+                yield prefix + "kernel", reader._iter_kernel(kernel_entry, COPY_CHUNK_SIZE)
+    elif entry.kind == KIND_INSTALLER and reader._read_plf_header(entry.header.offset + PLF_ENTRY_HEADER.size) is not None:
+        return
+    elif entry.kind != KIND_DIRECTORY and entry.kind != KIND_SYMLINK:
+        yield entry.output_path(), entry.chunks()
+
+def _search_worker(input_file, unit, patterns, is_regex, ignore_case, is_log):
+    # 在搜索进程中独立打开固件，逐块解压并扫描一组条目，返回(路径, 偏移, 模式, 匹配文本)
+    logger = Logger()
+    logger.log = is_log
+    matcher = PatternMatcher(patterns, is_regex, ignore_case)
+    reader = PlfReader(input_file, logger)
+    hits = []
+    try:
+        if not reader._open_firmware():
+            return hits
+        for offset, container in unit:
+            entry = reader._read_plf_entry(offset, container)
+            try:
+                for path, chunks in _search_contents(reader, entry):
+                    for hit_offset, pattern, text in matcher.search(chunks):
+                        hits.append((path, hit_offset, pattern, text))
+            except (zlib.error, lzma.LZMAError) as e:
+                logger.print_error("Entry at offset 0x{:08x} of {} cannot be decompressed: {}".format(offset, input_file, e))
+    finally:
+        reader.close()
+    return hits
+
+def do_search(input_files, patterns, is_log, jobs=1, is_regex=False, ignore_case=False):
+    # 不写入任何文件，在所有条目的内容中搜索多个模式，按固件和条目的顺序输出“固件:路径:偏移:匹配文本”。
+    # 条目按大小分组，单个固件和多个固件都由多个进程并行搜索
+    logger = Logger()
+    logger.log = is_log
+    units = []
+    for input_file in input_files:
+        units.extend(_search_units(input_file, jobs, logger))
+    arguments = [(input_file, unit, patterns, is_regex, ignore_case, is_log) for input_file, unit in units]
+    hit_num = 0
+    executor = None
+    if jobs > 1 and len(units) > 1:
+        executor = concurrent.futures.ProcessPoolExecutor(max_workers=jobs)
+        results = executor.map(_search_worker, *zip(*arguments))
+    else:
+        results = (_search_worker(*argument) for argument in arguments)
+    try:
+        for (input_file, unit), hits in zip(units, results):
+            for path, offset, pattern, text in hits:
+                hit_num = hit_num + 1
+                text = text.decode("utf-8", "backslashreplace").replace("\n", "\\n").replace("\r", "\\r")
+                print("{}:{}:{}:{}".format(input_file, path, offset, text))
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    logger.print_log("{} match(es) in {} firmware file(s)", hit_num, len(input_files))
+    return hit_num
+
+def _prometheus_labels(labels):
+    return ",".join('{}="{}"'.format(key, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+                    for key, value in labels)
+
+def metrics_to_prometheus(reports):
+    # 每个指标只输出一次HELP和TYPE，不同固件以firmware标签区分
+    families = {}
+    def add(name, metric_type, help_text, labels, value):
+        family = families.setdefault(name, (metric_type, help_text, []))
+        family[2].append((labels, value))
+    for report in reports:
+        firmware = ("firmware", os.path.basename(report["firmware"]))
+        add("plf_extraction_seconds", "gauge", "Wall time of the extraction.", [firmware], report["seconds"])
+        add("plf_firmware_bytes", "gauge", "Size of the firmware file.", [firmware], report["size"])
+        for phase, values in report["phases"].items():
+            add("plf_phase_seconds", "gauge", "Wall time spent in each phase on the reader thread.", [firmware, ("phase", phase)], values["seconds"])
+            add("plf_phase_bytes", "gauge", "Bytes processed in each phase.", [firmware, ("phase", phase)], values["bytes"])
+            add("plf_phase_entries", "gauge", "Entries processed in each phase.", [firmware, ("phase", phase)], values["entries"])
+        for entry_type, values in report["entry_types"].items():
+            add("plf_entry_type_entries", "gauge", "Entries of each entry type.", [firmware, ("type", entry_type)], values["entries"])
+            add("plf_entry_type_bytes", "gauge", "Stored bytes of each entry type.", [firmware, ("type", entry_type)], values["bytes"])
+            add("plf_entry_type_seconds", "gauge", "Wall time spent on each entry type.", [firmware, ("type", entry_type)], values["seconds"])
+        decompression = report["decompression"]
+        add("plf_decompression_entries", "gauge", "Compressed filesystem entries decompressed.", [firmware], decompression["entries"])
+        add("plf_decompression_input_bytes", "gauge", "Compressed bytes decompressed.", [firmware], decompression["compressed_bytes"])
+        add("plf_decompression_output_bytes", "gauge", "Bytes produced by decompression.", [firmware], decompression["uncompressed_bytes"])
+        add("plf_decompression_seconds", "gauge", "Time spent decompressing, summed over threads.", [firmware], decompression["seconds"])
+        add("plf_decompression_ratio", "gauge", "Uncompressed to compressed size ratio.", [firmware], decompression["ratio"])
+        for operation, number in report["operations"].items():
+            add("plf_operations_total", "counter", "Filesystem operations performed.", [firmware, ("operation", operation)], number)
+        for entry in report["slowest_entries"]:
+            add("plf_slowest_entry_seconds", "gauge", "Slowest entries of the extraction.",
+                [firmware, ("offset", entry["offset"]), ("type", entry["type"]), ("path", entry["path"])], entry["seconds"])
+        for key, value in report["statistics"].items():
+            add("plf_statistic", "gauge", "Extraction statistics.", [firmware, ("name", key)], value)
+    lines = []
+    for name, (metric_type, help_text, samples) in families.items():
+        lines.append("# HELP {} {}".format(name, help_text))
+        lines.append("# TYPE {} {}".format(name, metric_type))
+        for labels, value in samples:
+            lines.append("{}{{{}}} {}".format(name, _prometheus_labels(labels), repr(float(value))))
+    return "\n".join(lines) + "\n"
+
+def write_metrics(metrics_file, metrics_format, reports):
+    # 未指定格式时，.prom和.txt文件使用Prometheus文本格式，其他使用JSON
+    if metrics_format is None:
+        metrics_format = METRICS_PROMETHEUS if os.path.splitext(metrics_file)[1] in (".prom", ".txt") else METRICS_JSON
+    if metrics_format == METRICS_PROMETHEUS:
+        text = metrics_to_prometheus(reports)
+    else:
+        text = json.dumps({"firmwares": reports}, indent=2) + "\n"
+    with open(metrics_file, 'w') as f:
+        f.write(text)
+        f.close()
+
+def firmware_files(input_path):
+    # 目录下的所有固件文件（不含索引文件），或者单个固件文件
+    if not os.path.isdir(input_path):
+        return [input_path]
+    input_files = [os.path.join(input_path, file) for file in sorted(os.listdir(input_path)) if not file.endswith(index_file_suffix)]
+    return [input_file for input_file in input_files if os.path.isfile(input_file)]
+
+def firmware_output_dir(output_dir, input_file):
+    full_filename = os.path.basename(input_file)
+    filename, _ = os.path.splitext(full_filename)
+    return output_dir + '/' + filename
+
+def _batch_extract_worker(input_file, output_dir, is_log, is_info, options):
+    # 提取单个固件并计时，异常按文件收集，不中断整个批处理
+    start_time = time.perf_counter()
+    statistics = None
+    error = None
+    try:
+        statistics = do_extract(input_file, output_dir, is_log, is_info, options)
+    except Exception:
+        error = traceback.format_exc()
+    return input_file, time.perf_counter() - start_time, statistics, error
+
+def do_batch_extract(input_files, output_dir, is_log, is_info, jobs, options=None):
+    start_time = time.perf_counter()
+    results = []
+    if jobs > 1:
+        # 每个固件在独立的工作进程中提取，统计信息随结果一起返回
+        with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+            futures = {}
+            for input_file in input_files:
+                future = executor.submit(_batch_extract_worker, input_file, firmware_output_dir(output_dir, input_file), is_log, is_info, options)
+                futures[future] = input_file
+            for future in concurrent.futures.as_completed(futures):
+                try:
+                    results.append(future.result())
+                except Exception:
+                    # 工作进程异常退出等情况
+                    results.append((futures[future], 0.0, None, traceback.format_exc()))
+    else:
+        for input_file in input_files:
+            results.append(_batch_extract_worker(input_file, firmware_output_dir(output_dir, input_file), is_log, is_info, options))
+    _print_batch_summary(results, time.perf_counter() - start_time, is_log)
+    return results
+
+def _print_batch_summary(results, elapsed, is_log):
+    results = sorted(results, key=lambda result: result[1], reverse=True)
+    failures = [result for result in results if result[3] is not None]
+    print("[*] Batch summary: {} firmware file(s), {} failed, {:.3f} s elapsed, {:.3f} s spent in extraction.".format(
+        len(results), len(failures), elapsed, sum(result[1] for result in results)))
+    for input_file, file_elapsed, statistics, error in results:
+        if error is None:
+            print("[*] {:>9.3f} s  {}  {}  ({} file(s), {} directory(s), {} symbol link(s), {} unknown, CRC32 {:.3f} s, {} mismatch(es))".format(
+                file_elapsed, "CRC " if statistics[CRC_ERROR_NUM] > 0 else "SKIP" if statistics[UP_TO_DATE] else "OK  ", input_file, statistics[FILE_NUM], statistics[DIR_NUM],
+                statistics[SYMLINK_NUM], statistics[UNKNOWN_NUM], statistics[VERIFY_TIME], statistics[CRC_ERROR_NUM]))
+        else:
+            print("[*] {:>9.3f} s  FAIL  {}  ({})".format(file_elapsed, input_file, error.strip().splitlines()[-1]))
+    if is_log:
+        for input_file, _, _, error in failures:
+            print("[>] Extraction of {} failed:\n{}".format(input_file, error))
+
+def parse_server_address(address):
+    # host:port为TCP地址，其他为Unix套接字文件的路径
+    host, separator, port = address.rpartition(":")
+    if separator and port.isdigit() and "/" not in host:
+        return socket.AF_INET, (host or "127.0.0.1", int(port))
+    return socket.AF_UNIX, address
+
+def serve_job_options(job, threads):
+    # 服务模式的任务是一个JSON对象，read和write与命令行的-r和-w相同（只接受单个固件文件），
+    # 其他字段对应命令行的选项：threads、no_verify、verify_only、store、force、format、metrics、log和info
+    if not isinstance(job, dict) or not isinstance(job.get("read"), str) or not isinstance(job.get("write"), str):
+        raise ValueError("read and write paths are required")
+    if not os.path.isfile(job["read"]):
+        raise ValueError("{} is not a file".format(job["read"]))
+    options = ExtractOptions()
+    options.threads = int(job.get("threads") or threads)
+    options.verify_only = bool(job.get("verify_only", False))
+    options.verify = options.verify_only or not job.get("no_verify", False)
+    options.store = job.get("store")
+    options.resume = not job.get("force", False)
+    options.format = job.get("format")
+    options.metrics = bool(job.get("metrics", False))
+    if options.threads < 1:
+        raise ValueError("threads must be positive")
+    if options.format is not None and options.format not in ARCHIVE_FORMATS:
+        raise ValueError("unknown format {}".format(options.format))
+    if options.format == ARCHIVE_TAR_ZST and zstandard is None:
+        raise ValueError("format tar.zst requires the zstandard module")
+    if options.format is not None and options.store:
+        raise ValueError("store cannot be used with format")
+    return options
+
+def _serve_job(input_file, output_dir, is_log, is_info, options):
+    # 在服务的工作进程中执行一个任务。每个任务有自己的FirmwareFile和统计信息，
+    # 日志和错误信息写入缓冲区随结果返回，不会混入其他任务的输出
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output), contextlib.redirect_stderr(output):
+        result = _batch_extract_worker(input_file, output_dir, is_log, is_info, options)
+    return result + (output.getvalue(),)
+
+def _stop_server(signum, frame):
+    raise KeyboardInterrupt
+
+def do_serve(address, jobs, threads, is_log, is_info):
+    logger = Logger()
+    logger.log = is_log
+    logger.info = is_info
+    server = ExtractionServer(jobs, threads, logger)
+    # 收到SIGTERM时与Ctrl-C一样关闭服务，并删除Unix套接字文件
+    signal.signal(signal.SIGTERM, _stop_server)
+    try:
+        server.listen(address)
+    except OSError as e:
+        logger.print_error("Cannot serve on {}: {}".format(address, e))
+        return 1
+    try:
+        server.start()
+        logger.print_info("Serving on {} with {} worker process(es)", address, jobs)
+        server.serve()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+    return 0
+
+def _submit_jobs(client, jobs):
+    try:
+        for job in jobs:
+            client.sendall((json.dumps(job) + "\n").encode("utf-8"))
+        client.shutdown(socket.SHUT_WR)
+    except OSError:
+        pass
+
+def do_submit(address, input_files, output_dir, is_log, is_info, options):
+    # 把每个固件作为一个任务提交给服务，输出任务的日志以及与批处理相同的汇总。
+    # 任务在单独的线程中发送，服务暂停读取任务时仍然可以接收已完成的结果
+    start_time = time.perf_counter()
+    jobs = []
+    for input_file in input_files:
+        jobs.append({"id": len(jobs), "read": os.path.abspath(input_file), "write": os.path.abspath(output_dir),
+                     "threads": options.threads, "no_verify": not options.verify, "verify_only": options.verify_only,
+                     "store": os.path.abspath(options.store) if options.store else None, "force": not options.resume,
+                     "format": options.format, "metrics": options.metrics, "log": is_log, "info": is_info})
+    family, server_address = parse_server_address(address)
+    client = socket.socket(family, socket.SOCK_STREAM)
+    responses = {}
+    # 连接失败或者服务中途断开时，没有结果的任务按失败处理
+    missing = "No result from the server at {}".format(address)
+    try:
+        client.connect(server_address)
+        sender = threading.Thread(target=_submit_jobs, args=(client, jobs))
+        sender.start()
+        with client.makefile('rb') as f:
+            for line in f:
+                response = json.loads(line)
+                if response.get("log"):
+                    sys.stdout.write(response["log"])
+                responses[response.get("id")] = response
+            f.close()
+        sender.join()
+    except (OSError, ValueError) as e:
+        missing = "Connection to the server at {} failed: {}".format(address, e)
+    finally:
+        client.close()
+    results = []
+    for job, input_file in zip(jobs, input_files):
+        response = responses.get(job["id"], {"error": missing})
+        statistics = response.get("statistics")
+        if statistics is not None and response.get("metrics") is not None:
+            statistics[METRICS] = response["metrics"]
+        results.append((input_file, response.get("seconds", 0.0), statistics, response.get("error")))
+    _print_batch_summary(results, time.perf_counter() - start_time, is_log)
+    return results
 
 def main():
     # 命令行解析器
     parser = argparse.ArgumentParser(description="A program to extract kernel, bootparam, bootloader, installer and filesystem from parrot drones firmware.")
-    parser.add_argument('-r', '--read', required=True, help='Parrot firmware file or Parrot firmware file directory to read.')
-    parser.add_argument('-w', '--write', default=os.getcwd(), help='Output directory into which files will be extracted to.')
+    parser.add_argument('-r', '--read', help='Parrot firmware file or Parrot firmware file directory to read.')
+    parser.add_argument('-w', '--write', default=os.getcwd(), help='Output directory into which files will be extracted to. -: write the archive of a single firmware to the standard output (requires --format).')
     parser.add_argument('-l', '--log', action='store_true', help='True: extract files and display log about decompression process.')
     parser.add_argument('-i', '--info', action='store_true', help='True: extract files and display infomation about the overall extraction results.')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='Number of worker processes extracting the firmware files of a directory, or running the jobs of --serve, in parallel. 0: one per CPU.')
+    parser.add_argument('--list', action='store_true', help='List the entries of the firmware without extracting them. The index is saved next to the firmware file.')
+    parser.add_argument('--extract', nargs='+', metavar='PATH', help='Extract only the given filesystem paths (a directory path includes its contents) or output files such as bootloader.bin, using the saved index.')
+    parser.add_argument('--diff', nargs=2, metavar=('A', 'B'), help='Compare the entries of firmware A with firmware B by path, CRC32, size, permissions and symbol link target, without extracting them.')
+    parser.add_argument('--diff-content', action='store_true', help='With --diff, also decompress the modified entries and print their content changes.')
+    parser.add_argument('--search', nargs='+', metavar='PATTERN', help='Search the content of every entry for the given byte patterns without extracting, and print firmware:path:offset:match for each hit.')
+    parser.add_argument('--search-file', metavar='FILE', help='Read more --search patterns from FILE, one per line.')
+    parser.add_argument('--regex', action='store_true', help='The --search patterns are regular expressions instead of literal strings.')
+    parser.add_argument('--ignore-case', action='store_true', help='Match the --search patterns case-insensitively.')
+    parser.add_argument('--verify-only', action='store_true', help='Check the CRC32 of every entry without writing anything.')
+    parser.add_argument('--no-verify', action='store_true', help='Skip the CRC32 check of the entries for trusted inputs.')
+    parser.add_argument('--store', metavar='DIR', help='Content-addressed store shared by all extractions. Each unique file is written once into DIR and the filesystem trees are built from hard links to it.')
+    parser.add_argument('--format', choices=ARCHIVE_FORMATS, help='Write each firmware into one archive named after its output directory instead of a directory tree.')
+    parser.add_argument('--metrics', metavar='FILE', help='Write the timings, bytes and filesystem operations of each phase and entry type, the decompression ratio and the slowest entries to FILE.')
+    parser.add_argument('--metrics-format', choices=(METRICS_JSON, METRICS_PROMETHEUS), help='Format of the metrics file. Default: prometheus for .prom and .txt files, otherwise json.')
+    parser.add_argument('--force', action='store_true', help='Extract every entry again, ignoring the manifest left in the output directory by a previous extraction.')
+    parser.add_argument('-t', '--threads', type=int, default=0, help='Number of threads decompressing and writing the filesystem entries of one firmware. 0: share the CPUs among the worker processes.')
+    parser.add_argument('--serve', metavar='ADDRESS', help='Run an extraction server with -j warm worker processes on a Unix socket path or host:port, accepting one JSON job per line.')
+    parser.add_argument('--submit', metavar='ADDRESS', help='Submit the extraction of the -r firmware files to the server at ADDRESS instead of extracting them in this process.')
     args = parser.parse_args()
     # 读取命令行参数
     output_dir = args.write
     is_log = args.log
     is_info = args.info
+    jobs = args.jobs if args.jobs > 0 else (os.cpu_count() or 1)
+    options = ExtractOptions()
+    options.threads = args.threads if args.threads > 0 else max(1, (os.cpu_count() or 1) // jobs)
+    options.verify = args.verify_only or not args.no_verify
+    options.verify_only = args.verify_only
+    options.store = args.store
+    options.resume = not args.force
+    options.format = args.format
+    options.stdout = output_dir == "-"
+    options.metrics = args.metrics is not None
+    # 运行提取服务，-j为工作进程数，也是同时执行的任务数上限
+    if args.serve:
+        return do_serve(args.serve, jobs, options.threads, is_log, is_info)
+    # 比较两个固件
+    if args.diff:
+        return do_diff(args.diff[0], args.diff[1], is_log, args.diff_content)
+    if args.read is None:
+        parser.error("the following arguments are required: -r/--read (or --diff A B)")
+    # 在条目内容中搜索
+    if args.search or args.search_file:
+        patterns = list(args.search or [])
+        if args.search_file:
+            with open(args.search_file, 'r', encoding="utf-8") as f:
+                patterns.extend(line.rstrip("\r\n") for line in f)
+                f.close()
+        patterns = [pattern for pattern in patterns if pattern]
+        if not patterns:
+            parser.error("--search requires at least one non-empty pattern")
+        if args.regex:
+            for pattern in patterns:
+                try:
+                    re.compile(pattern.encode("utf-8"))
+                except re.error as e:
+                    parser.error("invalid --search pattern {}: {}".format(pattern, e))
+        hit_num = do_search(firmware_files(args.read), patterns, is_log, jobs, args.regex, args.ignore_case)
+        return 0 if hit_num > 0 else 1
+    if options.format == ARCHIVE_TAR_ZST and zstandard is None:
+        parser.error("--format tar.zst requires the zstandard module")
+    if options.format is not None and options.store:
+        parser.error("--store cannot be used with --format")
+    if options.stdout and (options.format is None or not os.path.isfile(args.read) or args.list or options.verify_only):
+        parser.error("-w - writes the archive of a single firmware file and requires --format")
+    # 提交给提取服务，未指定-t时由服务决定线程数
+    if args.submit:
+        if options.stdout or args.list or args.extract:
+            parser.error("--submit extracts whole firmware files into an output directory or archive")
+        options.threads = max(0, args.threads)
+        results = do_submit(args.submit, firmware_files(args.read), output_dir, is_log, is_info, options)
+        if args.metrics:
+            write_metrics(args.metrics, args.metrics_format, [result[2][METRICS] for result in results if result[2] is not None and METRICS in result[2]])
+        if any(result[3] is not None or result[2][CRC_ERROR_NUM] > 0 for result in results):
+            return 1
+        return 0
+    # 列出固件条目，或者只提取指定路径
+    if args.list or args.extract:
+        status = 0
+        for input_file in firmware_files(args.read):
+            if args.list:
+                found = do_list(input_file, is_log)
+            else:
+                found = do_extract_paths(input_file, firmware_output_dir(output_dir, input_file), args.extract, is_log, is_info, options)
+            if not found:
+                status = 1
+        return status
     # 判断是对单个文件进行提取还是对目录下所有文件进行提取，并执行提取操作。
     if os.path.isfile(args.read):
         input_file = args.read
-        full_filename = os.path.basename(input_file)
-        filename, _ = os.path.splitext(full_filename)
-        do_extract(input_file, output_dir + '/' + filename, is_log, is_info)
+        statistics = do_extract(input_file, firmware_output_dir(output_dir, input_file), is_log, is_info, options)
+        if args.metrics:
+            write_metrics(args.metrics, args.metrics_format, [statistics[METRICS]])
+        if options.verify_only:
+            print("[*] {}: {} entry(s) checked in {:.3f} s, {} CRC32 mismatch(es).".format(
+                input_file, statistics[VERIFY_NUM], statistics[VERIFY_TIME], statistics[CRC_ERROR_NUM]))
+        if statistics[CRC_ERROR_NUM] > 0:
+            return 1
     elif os.path.isdir(args.read):
-        input_dir = args.read
-        input_dir_files = [os.path.join(input_dir, file) for file in os.listdir(input_dir)]
-        for input_file in input_dir_files:
-            full_filename = os.path.basename(input_file)
-            filename, _ = os.path.splitext(full_filename)
-            do_extract(input_file, output_dir + '/' + filename, is_log, is_info)
+        results = do_batch_extract(firmware_files(args.read), output_dir, is_log, is_info, jobs, options)
+        if args.metrics:
+            write_metrics(args.metrics, args.metrics_format, [result[2][METRICS] for result in results if result[2] is not None and METRICS in result[2]])
+        if any(result[3] is not None or result[2][CRC_ERROR_NUM] > 0 for result in results):
+            return 1
+    return 0
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
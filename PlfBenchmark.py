@@ -0,0 +1,260 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+@File    :   PlfBenchmark.py
+@Desc    :   generate synthetic parrot firmware files and benchmark their extraction with ParrotExtraction.py.
+'''
+
+#############################################################
+# 导入模块
+import argparse
+import gzip
+import json
+import lzma
+import os
+import platform
+import random
+import shutil
+import struct
+import subprocess
+import sys
+import time
+import zlib
+import ParrotExtraction
+from ParrotExtraction import (PLF_HEADER, PLF_ENTRY_HEADER, PLF_MAGIC, FS_ENTRY_HEADER, VOLUME_CONFIG_HEADER, VOLUME_PARTITION,
+                              ENTRY_VOLUME_CONFIG, ENTRY_INSTALLER, ENTRY_BOOTLOADER, ENTRY_MAINBOOT, ENTRY_FILESYSTEM,
+                              KERNEL_ZIMAGE, KERNEL_BOOTPARAM, FS_DIR, FS_FILE, FS_SYMLINK, FS_DEVICE)
+try:
+    import resource
+except ImportError:
+    resource = None
+#############################################################
+# 全局变量
+## 文件大小的分布
+SIZE_EXP = "exp"
+SIZE_UNIFORM = "uniform"
+SIZE_FIXED = "fixed"
+SIZE_DISTRIBUTIONS = (SIZE_EXP, SIZE_UNIFORM, SIZE_FIXED)
+## 内核的压缩格式
+KERNEL_GZIP = "gzip"
+KERNEL_LZMA = "lzma"
+## 生成文件内容所用的单词，文本内容可压缩，其余为随机数据
+CONTENT_WORDS = (b"alpha ", b"bravo ", b"kernel ", b"parrot ", b"drone ", b"config ", b"busybox ", b"/usr/lib ", b"0x1f\n")
+## zImage中解压程序的替代数据，不包含gzip和lzma的起始标记
+ZIMAGE_STUB = b"\xa0\x01" * 0x1000
+## 未指定固件文件时生成的测试集
+BENCHMARK_SUITE = {
+    "small_files": {"entries": 20000, "mean_size": 2048, "compressed": 0.5, "symlinks": 500, "kernel": KERNEL_GZIP, "kernel_size": 0x200000},
+    "large_files": {"entries": 100, "mean_size": 0x80000, "compressed": 0.3, "symlinks": 20, "kernel": KERNEL_LZMA, "kernel_size": 0x400000},
+}
+#############################################################
+# 生成合成固件
+def plf_header(file_size, file_type=0):
+    return PLF_HEADER.pack(PLF_MAGIC, 13, PLF_HEADER.size, PLF_ENTRY_HEADER.size, file_type, 0, 0, 0, 0, 1, 0, 0, 0, file_size)
+
+def plf_entry(entry_type, payload, uncompressed_size=0):
+    # 文件系统条目按4字节对齐
+    data = PLF_ENTRY_HEADER.pack(entry_type, len(payload), zlib.crc32(payload), 0, uncompressed_size) + payload
+    if entry_type == ENTRY_FILESYSTEM and len(payload) % 4 != 0:
+        data = data + b"\x00" * (4 - len(payload) % 4)
+    return data
+
+def plf_file(entries, file_type=0):
+    body = b"".join(entries)
+    return plf_header(PLF_HEADER.size + len(body), file_type) + body
+
+def fs_entry(name, fs_type, permissions, data=b"", compress=False):
+    payload = name.encode("utf-8") + b"\x00" + FS_ENTRY_HEADER.pack((fs_type << 12) | permissions, 0, 0) + data
+    if compress:
+        return plf_entry(ENTRY_FILESYSTEM, gzip.compress(payload, 6), len(payload))
+    return plf_entry(ENTRY_FILESYSTEM, payload)
+
+def file_content(rng, size):
+    # 一半是可压缩的文本，一半是随机数据
+    if rng.random() < 0.5:
+        words = []
+        length = 0
+        while length < size:
+            word = rng.choice(CONTENT_WORDS)
+            words.append(word)
+            length = length + len(word)
+        return b"".join(words)[:size]
+    return rng.randbytes(size)
+
+def file_size(rng, distribution, mean_size):
+    if distribution == SIZE_FIXED:
+        return mean_size
+    if distribution == SIZE_UNIFORM:
+        return rng.randint(0, 2 * mean_size)
+    return int(rng.expovariate(1.0 / mean_size)) if mean_size > 0 else 0
+
+def volume_config():
+    partitions = [(b"system", b"/"), (b"data", b"/data")]
+    data = VOLUME_CONFIG_HEADER.pack(0, 0, 0, 0, 0, 0, 0, 0, 0, len(partitions))
+    for number, (name, mount_name) in enumerate(partitions):
+        data = data + VOLUME_PARTITION.pack(0x20, 1, number, 0, 0x1000000, 3, name, mount_name)
+    return data
+
+def main_boot(rng, kernel, kernel_size):
+    # zImage由解压程序和压缩的内核组成，lzma内核后追加4字节的解压后长度
+    kernel_data = file_content(random.Random(rng.random()), kernel_size) if kernel_size > 0 else b""
+    if kernel == KERNEL_LZMA:
+        compressed_kernel = lzma.compress(kernel_data, format=lzma.FORMAT_ALONE) + struct.pack("<I", len(kernel_data))
+    else:
+        compressed_kernel = gzip.compress(kernel_data, 6)
+    zimage = ZIMAGE_STUB + compressed_kernel + ZIMAGE_STUB[:0x100]
+    bootparams = b"console=ttyPA0,115200 root=/dev/mtdblock1 rootfstype=ubifs\x00"
+    return plf_file([plf_entry(KERNEL_ZIMAGE, zimage), plf_entry(KERNEL_BOOTPARAM, bootparams)])
+
+def installer(rng):
+    return plf_file([fs_entry("bin", FS_DIR, 0o755), fs_entry("bin/install.sh", FS_FILE, 0o755, b"#!/bin/sh\nflash_update\n"),
+                     plf_entry(ENTRY_BOOTLOADER, rng.randbytes(0x4000))])
+
+def generate_firmware(path, entries=2000, mean_size=4096, size_distribution=SIZE_EXP, compressed=0.5, symlinks=100,
+                      kernel=KERNEL_GZIP, kernel_size=0x200000, seed=0):
+    # 条目按顺序写入文件，最后回填固件头中的文件大小，内存占用与固件大小无关
+    rng = random.Random(seed)
+    directories = ["bin", "etc", "lib", "lib/modules", "usr", "usr/bin", "usr/lib", "usr/share", "var", "var/lib"]
+    directories.extend("usr/share/data{}".format(i) for i in range(max(0, entries // 200)))
+    with open(path, 'wb') as f:
+        f.write(plf_header(0))
+        f.write(plf_entry(ENTRY_VOLUME_CONFIG, volume_config()))
+        f.write(plf_entry(ENTRY_BOOTLOADER, rng.randbytes(0x10000)))
+        f.write(plf_entry(ENTRY_MAINBOOT, main_boot(rng, kernel, kernel_size)))
+        f.write(plf_entry(ENTRY_INSTALLER, installer(rng)))
+        for directory in directories:
+            f.write(fs_entry(directory, FS_DIR, 0o755))
+        files = []
+        for i in range(entries):
+            name = "{}/file{}.bin".format(rng.choice(directories), i)
+            files.append(name)
+            data = file_content(rng, file_size(rng, size_distribution, mean_size))
+            f.write(fs_entry(name, FS_FILE, rng.choice((0o644, 0o755, 0o600)), data, rng.random() < compressed))
+        for i in range(symlinks):
+            target = os.path.basename(rng.choice(files)) if files else "file"
+            f.write(fs_entry("bin/link{}".format(i), FS_SYMLINK, 0o777, target.encode("utf-8") + b"\x00"))
+        f.write(fs_entry("dev/console", FS_DEVICE, 0o600, b"\xb6\x21"))
+        size = f.tell()
+        f.seek(0)
+        f.write(plf_header(size))
+        f.close()
+    return size
+#############################################################
+# 运行基准测试
+def peak_rss():
+    # Linux上ru_maxrss的单位是KiB，macOS上是字节
+    if resource is None:
+        return 0
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == "darwin" else rss * 1024
+
+def run_once(input_file, output_dir, threads, verify):
+    # 在独立的进程中调用，峰值内存只包含这一次提取
+    options = ParrotExtraction.ExtractOptions()
+    options.threads = threads
+    options.verify = verify
+    options.resume = False
+    logger = ParrotExtraction.Logger()
+    start_time = time.perf_counter()
+    firmware = ParrotExtraction.FirmwareFile(input_file, output_dir, logger, options)
+    firmware.parse_firmware()
+    firmware.close()
+    elapsed = time.perf_counter() - start_time
+    return {"elapsed": elapsed, "timings": firmware.timings, "entries": firmware.statistics[ParrotExtraction.EXTRACTED_NUM],
+            "peak_rss": peak_rss()}
+
+def run_benchmark(input_file, work_dir, threads, verify, repeat):
+    output_dir = os.path.join(work_dir, "out")
+    runs = []
+    for i in range(repeat):
+        shutil.rmtree(output_dir, ignore_errors=True)
+        command = [sys.executable, os.path.abspath(__file__), "run-one", input_file, output_dir, "-t", str(threads)]
+        if not verify:
+            command.append("--no-verify")
+        result = subprocess.run(command, stdout=subprocess.PIPE, check=True)
+        runs.append(json.loads(result.stdout))
+    shutil.rmtree(output_dir, ignore_errors=True)
+    size = os.path.getsize(input_file)
+    best = min(runs, key=lambda run: run["elapsed"])
+    return {"name": os.path.splitext(os.path.basename(input_file))[0], "file": input_file, "size": size, "entries": best["entries"],
+            "threads": threads, "verify": verify, "runs": runs, "elapsed": best["elapsed"], "timings": best["timings"],
+            "mb_per_s": size / best["elapsed"] / 1e6, "entries_per_s": best["entries"] / best["elapsed"],
+            "peak_rss": max(run["peak_rss"] for run in runs)}
+
+def print_result(result, baseline=None):
+    line = "[*] {:<16} {:>8.1f} MB  {:>7} entries  {:>8.3f} s  {:>8.1f} MB/s  {:>10.0f} entries/s  peak RSS {:>7.1f} MiB".format(
+        result["name"], result["size"] / 1e6, result["entries"], result["elapsed"], result["mb_per_s"], result["entries_per_s"],
+        result["peak_rss"] / 0x100000)
+    if baseline is not None:
+        line = line + "  ({:+.1f}% MB/s)".format((result["mb_per_s"] / baseline["mb_per_s"] - 1) * 100)
+    print(line)
+    print("    " + "  ".join("{} {:.3f} s".format(phase, result["timings"][phase]) for phase in ParrotExtraction.TIMING_PHASES
+                             if result["timings"].get(phase)))
+
+def main():
+    # 命令行解析器
+    parser = argparse.ArgumentParser(description="Generate synthetic parrot firmware files and benchmark their extraction.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    generate_parser = subparsers.add_parser("generate", help="Write a synthetic firmware file.")
+    generate_parser.add_argument('-o', '--output', required=True, help='Firmware file to write.')
+    generate_parser.add_argument('--entries', type=int, default=2000, help='Number of regular files in the filesystem.')
+    generate_parser.add_argument('--mean-size', type=int, default=4096, help='Mean size of the regular files in bytes.')
+    generate_parser.add_argument('--size-distribution', choices=SIZE_DISTRIBUTIONS, default=SIZE_EXP, help='Distribution of the file sizes.')
+    generate_parser.add_argument('--compressed', type=float, default=0.5, help='Share of the files stored as gzip-compressed entries.')
+    generate_parser.add_argument('--symlinks', type=int, default=100, help='Number of symbol links.')
+    generate_parser.add_argument('--kernel', choices=(KERNEL_GZIP, KERNEL_LZMA), default=KERNEL_GZIP, help='Compression of the kernel in zImage.')
+    generate_parser.add_argument('--kernel-size', type=int, default=0x200000, help='Uncompressed size of the kernel in bytes.')
+    generate_parser.add_argument('--seed', type=int, default=0, help='Seed of the random contents.')
+    run_parser = subparsers.add_parser("run", help="Benchmark the extraction of firmware files. Without files, a synthetic suite is generated.")
+    run_parser.add_argument('firmware', nargs='*', help='Firmware files to extract.')
+    run_parser.add_argument('-w', '--work-dir', default="plf_benchmark", help='Directory for the generated firmware files and the extraction output.')
+    run_parser.add_argument('-t', '--threads', type=int, default=1, help='Threads decompressing and writing the filesystem entries.')
+    run_parser.add_argument('--no-verify', action='store_true', help='Skip the CRC32 check of the entries.')
+    run_parser.add_argument('--repeat', type=int, default=3, help='Runs per firmware file. The fastest run is reported.')
+    run_parser.add_argument('--json', help='Save the results to this JSON file.')
+    run_parser.add_argument('--compare', help='JSON file of a previous run to compare the throughput with.')
+    run_one_parser = subparsers.add_parser("run-one")
+    run_one_parser.add_argument('firmware')
+    run_one_parser.add_argument('output')
+    run_one_parser.add_argument('-t', '--threads', type=int, default=1)
+    run_one_parser.add_argument('--no-verify', action='store_true')
+    args = parser.parse_args()
+    if args.command == "generate":
+        size = generate_firmware(args.output, args.entries, args.mean_size, args.size_distribution, args.compressed, args.symlinks,
+                                 args.kernel, args.kernel_size, args.seed)
+        print("[*] {}: {:.1f} MB".format(args.output, size / 1e6))
+        return 0
+    if args.command == "run-one":
+        print(json.dumps(run_once(args.firmware, args.output, args.threads, not args.no_verify)))
+        return 0
+    if not os.path.exists(args.work_dir):
+        os.makedirs(args.work_dir)
+    input_files = args.firmware
+    if not input_files:
+        for name, parameters in BENCHMARK_SUITE.items():
+            input_file = os.path.join(args.work_dir, name + ".plf")
+            if not os.path.exists(input_file):
+                print("[*] Generating {}".format(input_file))
+                generate_firmware(input_file, **parameters)
+            input_files.append(input_file)
+    baselines = {}
+    if args.compare:
+        with open(args.compare) as f:
+            baselines = {result["name"]: result for result in json.load(f)["results"]}
+            f.close()
+    results = []
+    for input_file in input_files:
+        result = run_benchmark(input_file, args.work_dir, args.threads, not args.no_verify, max(1, args.repeat))
+        print_result(result, baselines.get(result["name"]))
+        results.append(result)
+    if args.json:
+        report = {"time": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": platform.python_version(), "platform": platform.platform(),
+                  "cpu_count": os.cpu_count(), "results": results}
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+            f.close()
+        print("[*] Results saved to {}".format(args.json))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())